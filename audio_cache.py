@@ -0,0 +1,143 @@
+import asyncio
+import logging
+import os
+import time
+
+# --- On-disk Audio Cache ---
+# Tracks played at least `min_plays` times are saved as <video id>.opus (Ogg/Opus) so later plays read
+# a local file instead of streaming from YouTube again. The directory listing is the index: file size
+# gives the byte budget and mtime is bumped on every hit, so a restart only needs one scandir.
+
+log = logging.getLogger(__name__)
+
+CACHE_SUFFIX = '.opus'
+PARTIAL_SUFFIX = '.part'
+STALE_PARTIAL_SECONDS = 3600 # A .part file untouched this long is from a crashed write, not one still in progress
+
+class AudioCache:
+    def __init__(self, directory, max_bytes=2 * 1024**3, min_plays=3, policy='lru', max_concurrent_writes=2):
+        if policy not in ('lru', 'lfu'): raise ValueError(f"Unknown audio cache policy: {policy}")
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.min_plays = min_plays
+        self.policy = policy
+        self._index = {} # video_id -> [size, last_used, plays]
+        self._play_counts = {} # video_id -> plays, for tracks not cached yet
+        self._writing = set()
+        self._write_slots = asyncio.Semaphore(max_concurrent_writes)
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        os.makedirs(directory, exist_ok=True)
+        self.rebuild_index()
+
+    def __contains__(self, video_id):
+        return video_id in self._index
+
+    def _path(self, video_id):
+        return os.path.join(self.directory, video_id + CACHE_SUFFIX)
+
+    def rebuild_index(self):
+        self._index.clear()
+        self.total_bytes = 0
+        now = time.time()
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if entry.name.endswith(PARTIAL_SUFFIX): # Left over from a write interrupted by a crash
+                    try:
+                        if entry.stat().st_mtime < now - STALE_PARTIAL_SECONDS: os.remove(entry.path)
+                    except OSError: pass
+                    continue
+                if not entry.name.endswith(CACHE_SUFFIX) or not entry.is_file(): continue
+                st = entry.stat()
+                self._index[entry.name[:-len(CACHE_SUFFIX)]] = [st.st_size, st.st_mtime, self.min_plays]
+                self.total_bytes += st.st_size
+        log.info("Audio cache index rebuilt: %d file(s), %.1f MB in %s", len(self._index), self.total_bytes / 1024**2, self.directory)
+        self._evict()
+
+    def lookup(self, video_id):
+        """Returns the local file for `video_id`, or None."""
+        entry = self._index.get(video_id) if video_id else None
+        if entry is None:
+            self.misses += 1
+            return None
+        path = self._path(video_id)
+        now = time.time()
+        try: os.utime(path, (now, now)) # Persist recency for the next index rebuild
+        except FileNotFoundError:
+            self._drop(video_id)
+            self.misses += 1
+            return None
+        entry[1] = now
+        self.hits += 1
+        return path
+
+    def record_play(self, video_id):
+        """Counts a play; returns True when the track should be written to the cache now."""
+        if not video_id: return False
+        if video_id in self._index:
+            self._index[video_id][2] += 1
+            return False
+        if len(self._play_counts) >= 50000: self._play_counts.clear() # Keep one-off plays from growing this forever
+        plays = self._play_counts.get(video_id, 0) + 1
+        self._play_counts[video_id] = plays
+        return plays >= self.min_plays and video_id not in self._writing
+
+    async def store(self, video_id, source, is_opus):
+        """Downloads `source` to <video id>.opus through a temp file, so readers never see a partial track."""
+        if video_id in self._index or video_id in self._writing: return
+        self._writing.add(video_id)
+        final_path = self._path(video_id)
+        partial_path = final_path + PARTIAL_SUFFIX
+        try:
+            async with self._write_slots:
+                codec_args = ['-c:a', 'copy'] if is_opus else ['-c:a', 'libopus', '-b:a', '128k']
+                proc = await asyncio.create_subprocess_exec(
+                    'ffmpeg', '-y', '-loglevel', 'error',
+                    '-reconnect', '1', '-reconnect_streamed', '1', '-reconnect_delay_max', '5',
+                    '-i', source, '-vn', '-map_metadata', '-1', *codec_args, '-f', 'ogg', partial_path,
+                    stdin=asyncio.subprocess.DEVNULL, stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.PIPE)
+                _, err = await proc.communicate()
+                if proc.returncode != 0:
+                    log.warning("Audio cache write failed for %s: %s", video_id, err.decode(errors='ignore').strip())
+                    return
+                os.replace(partial_path, final_path)
+            size = os.path.getsize(final_path)
+            self._index[video_id] = [size, time.time(), self._play_counts.pop(video_id, self.min_plays)]
+            self.total_bytes += size
+            log.debug("Audio cache stored %s (%.1f MB)", video_id, size / 1024**2)
+            self._evict()
+        except Exception:
+            log.exception("Error writing %s to audio cache", video_id)
+        finally:
+            self._writing.discard(video_id)
+            if os.path.exists(partial_path):
+                try: os.remove(partial_path)
+                except OSError: pass
+
+    def _drop(self, video_id):
+        entry = self._index.pop(video_id, None)
+        if entry: self.total_bytes -= entry[0]
+
+    def _evict(self):
+        if self.total_bytes <= self.max_bytes: return
+        if self.policy == 'lfu': rank = lambda item: (item[1][2], item[1][1])
+        else: rank = lambda item: item[1][1]
+        for video_id, _ in sorted(self._index.items(), key=rank):
+            if self.total_bytes <= self.max_bytes: break
+            try: os.remove(self._path(video_id))
+            except FileNotFoundError: pass
+            except OSError as e:
+                log.warning("Could not evict %s from audio cache: %s", video_id, e)
+                continue
+            self._drop(video_id)
+            self.evictions += 1
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "files": len(self._index), "bytes": self.total_bytes, "max_bytes": self.max_bytes,
+            "hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
@@ -0,0 +1,44 @@
+"""Serves generated audio files over local HTTP so ffmpeg can stream them like YouTube stream URLs."""
+import functools
+import os
+import shutil
+import subprocess
+import threading
+from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
+
+TONES = {
+    'tone-opus.webm': ['-c:a', 'libopus', '-b:a', '128k'], # Like YouTube format 251
+    'tone-aac.m4a': ['-c:a', 'aac', '-b:a', '128k'], # Like format 140; needs a transcode
+}
+
+def generate_tones(directory, seconds):
+    if not shutil.which('ffmpeg'): return False
+    for name, codec_args in TONES.items():
+        path = os.path.join(directory, name)
+        if os.path.exists(path): continue
+        subprocess.run(['ffmpeg', '-y', '-loglevel', 'error', '-f', 'lavfi', '-i', f'sine=frequency=440:duration={seconds}',
+                        '-ac', '2', '-ar', '48000', *codec_args, path], check=True)
+    return True
+
+class _QuietHandler(SimpleHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+class AudioServer:
+    def __init__(self, directory, host='127.0.0.1', port=0):
+        handler = functools.partial(_QuietHandler, directory=directory)
+        self.httpd = ThreadingHTTPServer((host, port), handler)
+        self.thread = threading.Thread(target=self.httpd.serve_forever, name='bench-audio-server', daemon=True)
+
+    @property
+    def base_url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.httpd.shutdown()
+        self.httpd.server_close()
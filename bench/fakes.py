@@ -0,0 +1,161 @@
+"""Local stand-ins for the Discord objects bot.py touches, so commands can run without a gateway or voice server."""
+import asyncio
+import itertools
+import threading
+import time
+
+import discord
+
+FRAME_SECONDS = 0.02
+_ids = itertools.count(10**17)
+
+class FakeMessage:
+    def __init__(self, content=None, embed=None):
+        self.content = content
+        self.embed = embed
+
+    async def edit(self, content=None, embed=None):
+        if content is not None: self.content = content
+        if embed is not None: self.embed = embed
+
+class FakeVoiceClient:
+    """Plays an AudioSource the way discord.py's AudioPlayer does: one read() per 20 ms on its own thread."""
+
+    def __init__(self, channel, listener=None):
+        self.channel = channel
+        self.guild = channel.guild
+        self.listener = listener # listener(guild_id, 'audio' | 'end'), called from the player thread
+        self._connected = True
+        self._silent_stop = False
+        self._source = None
+        self._thread = None
+        self._stop = threading.Event()
+        self._resumed = threading.Event()
+        self._resumed.set()
+        self.frames_sent = 0
+
+    def is_connected(self): return self._connected
+    def is_playing(self): return self._source is not None and self._resumed.is_set()
+    def is_paused(self): return self._source is not None and not self._resumed.is_set()
+
+    def play(self, source, *, after=None):
+        if self._source is not None: raise discord.ClientException('Already playing audio.')
+        self._source = source
+        self._stop = threading.Event()
+        self._silent_stop = False
+        self._resumed.set()
+        self._thread = threading.Thread(target=self._run, args=(source, after, self._stop), daemon=True)
+        self._thread.start()
+
+    def _run(self, source, after, stop):
+        error, first = None, True
+        start = time.perf_counter()
+        frames = 0
+        try:
+            while not stop.is_set():
+                if not self._resumed.is_set():
+                    self._resumed.wait(0.1)
+                    start = time.perf_counter() - frames * FRAME_SECONDS
+                    continue
+                data = source.read()
+                if not data:
+                    if self.listener: self.listener(self.guild.id, 'end')
+                    break
+                if first and self.listener:
+                    first = False
+                    self.listener(self.guild.id, 'audio')
+                frames += 1
+                self.frames_sent += 1
+                delay = start + frames * FRAME_SECONDS - time.perf_counter()
+                if delay > 0: time.sleep(delay)
+        except Exception as e:
+            error = e
+        finally:
+            source.cleanup()
+            if self._source is source: self._source = None
+            if after and not self._silent_stop: after(error)
+
+    def stop(self):
+        self._stop.set()
+        self._source = None
+
+    def drop(self):
+        """A connection loss no event reports: playback stops without calling `after`, so only a sweep can notice."""
+        self._silent_stop = True
+        self.stop()
+        self._connected = False
+        if self.guild.voice_client is self: self.guild.voice_client = None
+
+    def pause(self): self._resumed.clear()
+    def resume(self): self._resumed.set()
+
+    async def move_to(self, channel):
+        self.channel = channel
+
+    async def disconnect(self, *, force=False):
+        self.stop()
+        self._connected = False
+        if self.guild.voice_client is self: self.guild.voice_client = None
+
+class FakeGuild:
+    def __init__(self, guild_id=None):
+        self.id = guild_id or next(_ids)
+        self.name = f"guild-{self.id}"
+        self.voice_client = None
+
+class FakeVoiceChannel(discord.VoiceChannel):
+    # Subclasses the real class because bot.py checks isinstance(channel, discord.VoiceChannel)
+    def __init__(self, guild, connect_latency=0.0, listener=None):
+        self.id = next(_ids)
+        self.name = f"voice-{self.id}"
+        self.guild = guild
+        self.connect_latency = connect_latency
+        self.listener = listener
+
+    async def connect(self, *, timeout=60.0, reconnect=True, **kwargs):
+        if self.connect_latency: await asyncio.sleep(self.connect_latency)
+        vc = FakeVoiceClient(self, listener=self.listener)
+        self.guild.voice_client = vc
+        return vc
+
+class FakeMember:
+    def __init__(self, channel):
+        self.id = next(_ids)
+        self.mention = f"<@{self.id}>"
+        self.voice = type('VoiceState', (), {'channel': channel})()
+
+    def __str__(self): return f"member-{self.id}"
+
+class _Typing:
+    async def __aenter__(self): return self
+    async def __aexit__(self, *exc): return False
+
+class FakeContext:
+    def __init__(self, guild, author, command_name='play'):
+        self.guild = guild
+        self.author = author
+        self.sent = []
+        self.command = type('Command', (), {'name': command_name})()
+        self.message = type('Message', (), {'content': ''})()
+
+    async def send(self, content=None, *, embed=None):
+        message = FakeMessage(content, embed)
+        self.sent.append(message)
+        return message
+
+    def typing(self):
+        return _Typing()
+
+class SyntheticOpusSource(discord.AudioSource):
+    """Stands in for ffmpeg when it isn't installed: `seconds` of Opus silence frames."""
+
+    def __init__(self, seconds):
+        self.remaining = int(seconds / FRAME_SECONDS)
+
+    def read(self):
+        if self.remaining <= 0: return b''
+        self.remaining -= 1
+        return b'\xf8\xff\xfe'
+
+    def is_opus(self): return True
+    def cleanup(self): self.remaining = 0
@@ -0,0 +1,334 @@
+"""Drives bot.py's commands and callbacks across many simulated guilds and reports latency, CPU and memory.
+
+Usage: python bench/load_test.py [--guilds 20] [--scenarios play,queue,skip,transitions,keepalive]
+                                 [--latency 0.5] [--track-seconds 4] [--synthetic] [--compare RESULTS.json]
+
+Discord is replaced by the fakes in fakes.py and yt-dlp by stub_extractor.py (recorded info dicts from
+bench/fixtures, served with an artificial delay). Stream URLs point at a local HTTP server with generated
+tones, so ffmpeg does the same work it would on a YouTube URL. Without ffmpeg (or with --synthetic) players
+emit Opus silence instead, which still exercises everything except the decode itself.
+Results are written to bench/results/ as JSON.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+sys.path.insert(0, BENCH_DIR)
+os.environ.setdefault('LOG_LEVEL', 'WARNING') # bot.py logs on every command; that would dominate the numbers
+import bot # noqa: E402 (needs the repo root on sys.path)
+from audio_server import AudioServer, generate_tones # noqa: E402
+from fakes import FakeContext, FakeGuild, FakeMember, FakeVoiceChannel, SyntheticOpusSource # noqa: E402
+from guild_player import Track # noqa: E402
+from reconnect import ReconnectScheduler # noqa: E402
+from resolver import ResolutionCache # noqa: E402
+from broadcast import BroadcastHub # noqa: E402
+from stub_extractor import StubExtractor # noqa: E402
+
+RESULTS_DIR = os.path.join(BENCH_DIR, 'results')
+SEARCH_TERMS = ['lofi beats', 'synthwave mix', 'jazz piano', 'drum and bass', 'city pop', 'ambient',
+                'chiptune', 'vaporwave', 'post rock', 'bossa nova', 'trip hop', 'shoegaze']
+
+def percentiles(samples):
+    if not samples: return {"n": 0}
+    ordered = sorted(samples)
+    pick = lambda q: ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+    return {"n": len(ordered), "p50": pick(0.50), "p95": pick(0.95), "p99": pick(0.99), "max": ordered[-1]}
+
+def rss_mb():
+    fields = {}
+    with open('/proc/self/status') as f:
+        for line in f:
+            key, _, value = line.partition(':')
+            if key in ('VmRSS', 'VmHWM'): fields[key] = int(value.split()[0]) / 1024
+    return fields.get('VmRSS'), fields.get('VmHWM')
+
+class LagMonitor:
+    """Measures how late a sleeping task wakes up; anything blocking the event loop shows up here."""
+
+    def __init__(self, interval=0.05):
+        self.interval = interval
+        self.samples = []
+        self._task = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            self.samples.append(max(0.0, loop.time() - expected) * 1000)
+
+    def __enter__(self):
+        self._task = asyncio.get_running_loop().create_task(self._run())
+        return self
+
+    def __exit__(self, *exc):
+        self._task.cancel()
+
+class AudioProbe:
+    """Collects 'audio started' and 'track ended' events from the fake voice clients' player threads."""
+
+    def __init__(self, loop):
+        self.loop = loop
+        self.waiters = {} # guild_id -> [Future resolved with the perf_counter of the next first frame]
+        self.ended_at = {} # guild_id -> perf_counter of the last natural end
+        self.gaps = [] # ms from a track ending on its own to the next one's first frame
+
+    def listener(self, guild_id, event):
+        now = time.perf_counter()
+        self.loop.call_soon_threadsafe(self._record, guild_id, event, now)
+
+    def _record(self, guild_id, event, now):
+        if event == 'end':
+            self.ended_at[guild_id] = now
+            return
+        ended = self.ended_at.pop(guild_id, None)
+        if ended is not None: self.gaps.append((now - ended) * 1000)
+        for future in self.waiters.pop(guild_id, ()):
+            if not future.done(): future.set_result(now)
+
+    def expect(self, guild_id):
+        future = self.loop.create_future()
+        self.waiters.setdefault(guild_id, []).append(future)
+        return future
+
+class SimGuild:
+    def __init__(self, probe, connect_latency):
+        self.guild = FakeGuild()
+        self.channel = FakeVoiceChannel(self.guild, connect_latency=connect_latency, listener=probe.listener)
+        self.member = FakeMember(self.channel)
+
+    @property
+    def id(self):
+        return self.guild.id
+
+    def ctx(self, command_name):
+        return FakeContext(self.guild, self.member, command_name)
+
+async def timed(samples, coro):
+    start = time.perf_counter()
+    await coro
+    samples.append((time.perf_counter() - start) * 1000)
+
+async def wait_first_audio(futures, started_at, samples, timeout):
+    done, pending = await asyncio.wait(futures, timeout=timeout)
+    samples.extend((f.result() - started_at) * 1000 for f in done)
+    return len(pending)
+
+class Harness:
+    def __init__(self, args, loop, base_url):
+        self.args = args
+        self.loop = loop
+        self.stub = StubExtractor.from_file(base_url=base_url, latency=args.latency, jitter=args.jitter,
+                                            duration=args.track_seconds)
+        bot.ytdl_pool = self.stub
+        bot.bot.loop = loop # Normally set by bot.run(); the callbacks schedule work on it
+        self.channels = {}
+        bot.bot.get_channel = self.channels.get
+        if args.synthetic:
+            bot.create_ffmpeg_player = lambda song_info, start=0.0, force_opus=False: SyntheticOpusSource(max(0.0, args.track_seconds - start))
+
+    def reset(self):
+        # Every scenario starts from empty per-guild state and cold caches
+        bot.music_queues.clear()
+        bot.resolution_cache = ResolutionCache(max_entries=bot.resolution_cache.max_entries)
+        if bot.broadcast_hub: bot.broadcast_hub = BroadcastHub(buffer_seconds=bot.BROADCAST_BUFFER_SECONDS, attach_window=bot.BROADCAST_ATTACH_WINDOW)
+        bot.rejoin_scheduler = ReconnectScheduler(bot.attempt_rejoin, max_parallel=bot.RECONNECT_PARALLEL,
+                                                  connects_per_second=self.args.reconnect_rate or bot.RECONNECT_RATE)
+        self.stub.calls = 0
+        self.probe = AudioProbe(self.loop)
+        self.guilds = [SimGuild(self.probe, self.args.connect_latency) for _ in range(self.args.guilds)]
+        self.channels.clear()
+        self.channels.update({g.channel.id: g.channel for g in self.guilds})
+
+    async def teardown(self):
+        for state in list(bot.music_queues.values()):
+            bot.cancel_ingest(state)
+            bot.discard_prefetch(state)
+            bot.rejoin_scheduler.cancel(state.guild_id)
+            state.queue.clear()
+            state.keep_alive_active = False
+            state.last_channel_id = None
+            state.current_song = None
+            state.current_source = None
+            if state.voice_client: await state.voice_client.disconnect(force=True)
+        await asyncio.sleep(0.1) # Let the last after-callbacks run against the emptied state
+
+    def query(self):
+        return random.choice(SEARCH_TERMS[:self.args.distinct_queries])
+
+    async def play_all(self, samples=None, ttfa=None):
+        futures = [self.probe.expect(g.id) for g in self.guilds]
+        started_at = time.perf_counter()
+        await asyncio.gather(*(timed(samples if samples is not None else [], bot.play(g.ctx('play'), query=self.query())) for g in self.guilds))
+        missing = await wait_first_audio(futures, started_at, ttfa if ttfa is not None else [], timeout=30)
+        if missing: print(f"WARNING: {missing} guild(s) never started audio.", file=sys.stderr)
+
+    # --- Scenarios ---
+
+    async def scenario_play(self):
+        latency, ttfa = [], []
+        await self.play_all(latency, ttfa)
+        return {"command_ms": percentiles(latency), "first_audio_ms": percentiles(ttfa)}
+
+    async def scenario_queue(self):
+        await self.play_all()
+        for g in self.guilds:
+            entries = [{'id': f"q{g.id}-{i}", 'title': f"Queued track {i}", 'url': f"https://www.youtube.com/watch?v=q{i}"}
+                       for i in range(self.args.queue_length)]
+            bot.get_guild_state(g.id).enqueue_many([Track.placeholder(e) for e in entries])
+        pages = max(1, self.args.queue_length // bot.QUEUE_PAGE_SIZE)
+        latency = []
+        for _ in range(self.args.rounds):
+            await asyncio.gather(*(timed(latency, bot.queue(g.ctx('queue'), page=random.randint(1, pages))) for g in self.guilds))
+        return {"command_ms": percentiles(latency)}
+
+    async def scenario_skip(self):
+        await self.play_all()
+        batch = " | ".join(random.sample(SEARCH_TERMS, min(len(SEARCH_TERMS), self.args.rounds)))
+        await asyncio.gather(*(bot.play(g.ctx('play'), query=batch) for g in self.guilds))
+        latency, gaps, missing = [], [], 0
+        for _ in range(self.args.rounds):
+            futures = [self.probe.expect(g.id) for g in self.guilds]
+            started_at = time.perf_counter()
+            await asyncio.gather(*(timed(latency, bot.skip(g.ctx('skip'))) for g in self.guilds))
+            missing += await wait_first_audio(futures, started_at, gaps, timeout=30)
+            await asyncio.sleep(self.args.settle)
+        return {"command_ms": percentiles(latency), "skip_to_audio_ms": percentiles(gaps), "no_audio": missing}
+
+    async def scenario_transitions(self):
+        # Short tracks play out on their own, so every change goes through the real after -> song_finished_callback path
+        callback_ms = []
+        original = bot.song_finished_callback
+        async def timed_callback(*args, **kwargs):
+            await timed(callback_ms, original(*args, **kwargs))
+        bot.song_finished_callback = timed_callback
+        try:
+            await self.play_all()
+            batch = " | ".join(random.sample(SEARCH_TERMS, min(len(SEARCH_TERMS), self.args.rounds)))
+            await asyncio.gather(*(bot.play(g.ctx('play'), query=batch) for g in self.guilds))
+            deadline = time.monotonic() + (self.args.rounds + 2) * (self.args.track_seconds + 5)
+            while time.monotonic() < deadline and any(s.current_song or s.queue for s in bot.music_queues.values()):
+                await asyncio.sleep(0.2)
+        finally:
+            bot.song_finished_callback = original
+        return {"transition_gap_ms": percentiles(self.probe.gaps), "song_finished_callback_ms": percentiles(callback_ms)}
+
+    async def scenario_keepalive(self):
+        await asyncio.gather(*(bot.stay(g.ctx('stay')) for g in self.guilds))
+        await asyncio.sleep(self.args.settle)
+        for g in self.guilds: g.guild.voice_client.drop() # Connections lost without any event
+        futures = [self.probe.expect(g.id) for g in self.guilds]
+        sweep_ms = []
+        started_at = time.perf_counter()
+        await timed(sweep_ms, bot.keep_alive_task())
+        recovered = []
+        missing = await wait_first_audio(futures, started_at, recovered, timeout=self.args.guilds / (self.args.reconnect_rate or bot.RECONNECT_RATE) + 30)
+        return {"sweep_ms": percentiles(sweep_ms), "drop_to_audio_ms": percentiles(recovered), "not_recovered": missing,
+                "reconnect": bot.rejoin_scheduler.stats()}
+
+    async def run(self, name):
+        self.reset()
+        cpu_before, wall_before = os.times(), time.perf_counter()
+        with LagMonitor() as lag:
+            result = await getattr(self, f"scenario_{name}")()
+            await self.teardown()
+        cpu_after, wall = os.times(), time.perf_counter() - wall_before
+        rss, peak_rss = rss_mb()
+        result.update({
+            "wall_s": wall,
+            "cpu_s": (cpu_after.user + cpu_after.system) - (cpu_before.user + cpu_before.system),
+            "children_cpu_s": (cpu_after.children_user + cpu_after.children_system) - (cpu_before.children_user + cpu_before.children_system),
+            "loop_lag_ms": percentiles(lag.samples),
+            "rss_mb": rss, "peak_rss_mb": peak_rss,
+            "extractor_calls": self.stub.calls,
+            "resolution_cache": bot.resolution_cache.stats(),
+        })
+        if bot.broadcast_hub: result["broadcast"] = bot.broadcast_hub.stats()
+        return result
+
+# --- Reporting ---
+
+def flatten(result, prefix=''):
+    for key, value in result.items():
+        if isinstance(value, dict): yield from flatten(value, f"{prefix}{key}.")
+        elif isinstance(value, (int, float)) and not isinstance(value, bool): yield f"{prefix}{key}", value
+
+def report(results, baseline=None):
+    for name, result in results["scenarios"].items():
+        print(f"\n== {name} ==")
+        base = dict(flatten(baseline["scenarios"].get(name, {}))) if baseline else {}
+        for key, value in flatten(result):
+            line = f"  {key:<36} {value:>12.2f}"
+            if key in base and base[key]:
+                line += f"  (baseline {base[key]:.2f}, {100 * (value - base[key]) / base[key]:+.1f}%)"
+            print(line)
+
+def git_revision():
+    try: return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, cwd=BENCH_DIR).stdout.strip() or None
+    except OSError: return None
+
+async def main_async(args, base_url):
+    harness = Harness(args, asyncio.get_running_loop(), base_url)
+    scenarios = {}
+    for name in args.scenarios:
+        print(f"Running {name} with {args.guilds} guild(s)...", file=sys.stderr)
+        scenarios[name] = await harness.run(name)
+    return scenarios
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--guilds', type=int, default=20)
+    parser.add_argument('--scenarios', default='play,queue,skip,transitions,keepalive', type=lambda s: s.split(','))
+    parser.add_argument('--latency', type=float, default=0.5, help='Mean simulated yt-dlp extraction time (s)')
+    parser.add_argument('--jitter', type=float, default=0.25, help='Standard deviation of the extraction time (s)')
+    parser.add_argument('--connect-latency', type=float, default=0.2, help='Simulated voice connect time (s)')
+    parser.add_argument('--distinct-queries', type=int, default=len(SEARCH_TERMS), help='How many different searches guilds pick from')
+    parser.add_argument('--track-seconds', type=float, default=4.0, help='Length of every track')
+    parser.add_argument('--queue-length', type=int, default=500)
+    parser.add_argument('--rounds', type=int, default=5, help='Skips / queue views / tracks per guild')
+    parser.add_argument('--settle', type=float, default=0.5, help='Pause between rounds (s)')
+    parser.add_argument('--reconnect-rate', type=float, help='Override RECONNECT_RATE for the keepalive scenario')
+    parser.add_argument('--synthetic', action='store_true', help='Skip ffmpeg and play generated Opus silence')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--compare', metavar='RESULTS_JSON', help='Earlier results to compare against')
+    parser.add_argument('--output', metavar='RESULTS_JSON', help='Where to save results (default bench/results/<time>.json)')
+    parser.add_argument('--verbose', action='store_true', help="Show the bot's INFO logs")
+    args = parser.parse_args()
+    random.seed(args.seed)
+    bot.setup() # Logging, as bot.py's own entry point would
+    if args.verbose: logging.getLogger().setLevel(logging.INFO)
+    if not args.synthetic and not shutil.which('ffmpeg'):
+        print("ffmpeg not found; falling back to --synthetic.", file=sys.stderr)
+        args.synthetic = True
+
+    with tempfile.TemporaryDirectory() as tmp:
+        if not args.synthetic: generate_tones(tmp, args.track_seconds)
+        with AudioServer(tmp) as server:
+            scenarios = asyncio.run(main_async(args, server.base_url))
+
+    results = {
+        "meta": {"time": time.strftime('%Y-%m-%dT%H:%M:%S'), "revision": git_revision(), "python": sys.version.split()[0],
+                 "args": {k: v for k, v in vars(args).items() if k not in ('compare', 'output', 'verbose')}},
+        "scenarios": scenarios,
+    }
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f: baseline = json.load(f)
+    report(results, baseline)
+    output = args.output or os.path.join(RESULTS_DIR, time.strftime('%Y%m%d-%H%M%S') + '.json')
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f: json.dump(results, f, indent=2)
+    print(f"\nSaved results to {output}")
+
+if __name__ == "__main__":
+    main()
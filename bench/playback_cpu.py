@@ -0,0 +1,90 @@
+"""Compares CPU per concurrent stream for PCM re-encoding vs Opus passthrough playback.
+
+Usage: python bench/playback_cpu.py [--source FILE_OR_URL] [--streams 10] [--seconds 20]
+
+Without --source a 2 minute Opus/WebM test tone is generated with ffmpeg (like YouTube's format 251).
+Each stream is read at the real 20 ms frame pace, the same way discord.py's AudioPlayer does,
+and PCM frames are Opus-encoded in this process just like VoiceClient.send_audio_packet would.
+"""
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import bot # noqa: E402 (needs the repo root on sys.path)
+import discord # noqa: E402
+from guild_player import Track # noqa: E402
+
+FRAME_SECONDS = discord.opus.Encoder.FRAME_LENGTH / 1000
+
+def make_test_source(directory):
+    path = os.path.join(directory, 'bench-tone.webm')
+    subprocess.run(
+        ['ffmpeg', '-y', '-loglevel', 'error', '-f', 'lavfi', '-i', 'sine=frequency=440:duration=120',
+         '-ac', '2', '-ar', '48000', '-c:a', 'libopus', '-b:a', '128k', path],
+        check=True)
+    return path
+
+def stream_worker(player, seconds, stop_event):
+    encoder = None if player.is_opus() else discord.opus.Encoder()
+    frames = int(seconds / FRAME_SECONDS)
+    start = time.perf_counter()
+    for i in range(frames):
+        if stop_event.is_set(): break
+        data = player.read()
+        if not data: break
+        if encoder: encoder.encode(data, encoder.SAMPLES_PER_FRAME)
+        delay = start + (i + 1) * FRAME_SECONDS - time.perf_counter()
+        if delay > 0: time.sleep(delay)
+
+def cpu_times():
+    t = os.times()
+    return t.user + t.system, t.children_user + t.children_system
+
+def run(mode, source, streams, seconds):
+    bot.PLAYBACK_MODE = mode
+    song_info = Track("bench", source, acodec="opus") # No id: every stream gets its own ffmpeg rather than one shared broadcast
+    self_before, children_before = cpu_times()
+    players = [bot.create_player(song_info) for _ in range(streams)]
+    stop_event = threading.Event()
+    threads = [threading.Thread(target=stream_worker, args=(p, seconds, stop_event), daemon=True) for p in players]
+    wall_start = time.perf_counter()
+    for t in threads: t.start()
+    for t in threads: t.join()
+    wall = time.perf_counter() - wall_start
+    for p in players: p.cleanup() # Reaps ffmpeg so its CPU shows up in children times
+    self_after, children_after = cpu_times()
+    bot_cpu, ffmpeg_cpu = self_after - self_before, children_after - children_before
+    return {
+        "mode": mode, "streams": streams, "wall_s": wall,
+        "bot_cpu_s": bot_cpu, "ffmpeg_cpu_s": ffmpeg_cpu,
+        "cpu_pct_per_stream": 100 * (bot_cpu + ffmpeg_cpu) / wall / streams,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--source', help='Audio file or URL to stream (should be Opus for a fair comparison)')
+    parser.add_argument('--streams', type=int, default=10)
+    parser.add_argument('--seconds', type=float, default=20.0)
+    args = parser.parse_args()
+    if not discord.opus.is_loaded():
+        sys.exit("libopus is not loaded; the PCM path can't be measured.")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        source = args.source or make_test_source(tmp)
+        results = [run(mode, source, args.streams, args.seconds) for mode in ('pcm', 'auto')]
+
+    print(f"{'mode':<6} {'streams':>7} {'bot cpu s':>10} {'ffmpeg cpu s':>13} {'cpu %/stream':>13}")
+    for r in results:
+        name = 'opus' if r['mode'] == 'auto' else r['mode']
+        print(f"{name:<6} {r['streams']:>7} {r['bot_cpu_s']:>10.2f} {r['ffmpeg_cpu_s']:>13.2f} {r['cpu_pct_per_stream']:>13.2f}")
+    pcm, opus = results
+    if opus['cpu_pct_per_stream']:
+        print(f"Opus passthrough uses {pcm['cpu_pct_per_stream'] / opus['cpu_pct_per_stream']:.1f}x less CPU per stream.")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""Replays recorded yt-dlp info dicts in place of the YtdlPool, with configurable latency.
+
+Record fresh fixtures (needs network access and yt-dlp):
+    python bench/stub_extractor.py --record "https://www.youtube.com/watch?v=..." "some search" > bench/fixtures/ytdl_infos.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+import zlib
+from urllib.parse import urlparse, parse_qs
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from ytdl_pool import ExtractorError, _slim_info # noqa: E402
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'ytdl_infos.json')
+
+class StubExtractor:
+    """Same interface as YtdlPool.extract(); stream URLs point at `base_url` (see audio_server.py)."""
+
+    def __init__(self, infos, base_url, latency=0.5, jitter=0.25, url_ttl=6 * 3600, duration=None):
+        self.infos = infos
+        self.by_id = {info['id']: info for info in infos}
+        self.base_url = base_url.rstrip('/')
+        self.latency = latency
+        self.jitter = jitter
+        self.url_ttl = url_ttl
+        self.duration = duration # Overrides recorded durations so runs can use short tracks
+        self.calls = 0
+
+    @classmethod
+    def from_file(cls, path=FIXTURES, **kwargs):
+        with open(path) as f: return cls(json.load(f), **kwargs)
+
+    def _stream_info(self, info):
+        stream = {k: v for k, v in info.items() if k != 'file'}
+        stream['url'] = f"{self.base_url}/{info['file']}?expire={int(time.time()) + self.url_ttl}"
+        stream['webpage_url'] = f"https://www.youtube.com/watch?v={info['id']}"
+        if self.duration: stream['duration'] = self.duration
+        return stream
+
+    def _pick(self, query):
+        # Deterministic, so the same search always "finds" the same track (exercises the resolution cache)
+        return self.infos[zlib.crc32(query.lower().encode()) % len(self.infos)]
+
+    async def extract(self, target, **overrides):
+        self.calls += 1
+        await asyncio.sleep(max(0.0, random.gauss(self.latency, self.jitter)))
+        if overrides.get('extract_flat'):
+            start, end = (int(x) for x in overrides.get('playlist_items', f"1-{len(self.infos)}").split('-'))
+            entries = [{'_type': 'url', 'id': i['id'], 'title': i['title'], 'duration': self.duration or i.get('duration'),
+                        'url': f"https://www.youtube.com/watch?v={i['id']}"} for i in self.infos[start - 1:end]]
+            return {'_type': 'playlist', 'title': 'Bench playlist', 'entries': entries}
+        if target.startswith('ytsearch:'):
+            return {'_type': 'playlist', 'entries': [self._stream_info(self._pick(target[len('ytsearch:'):]))]}
+        video_id = parse_qs(urlparse(target).query).get('v', [None])[0]
+        if video_id not in self.by_id: raise ExtractorError(f"DownloadError: no recorded info for {target}")
+        return self._stream_info(self.by_id[video_id])
+
+    def stats(self):
+        return {"calls": self.calls}
+
+    def close(self):
+        pass
+
+def record(targets):
+    import yt_dlp
+    infos = []
+    with yt_dlp.YoutubeDL({'format': 'bestaudio/best', 'quiet': True, 'default_search': 'ytsearch'}) as ydl:
+        for target in targets:
+            info = _slim_info(ydl.sanitize_info(ydl.extract_info(target, download=False)))
+            if info.get('entries'): info = info['entries'][0]
+            info.pop('url', None) # Replaced by a local audio_server URL at replay time
+            info['file'] = 'tone-opus.webm' if (info.get('acodec') or '').startswith('opus') else 'tone-aac.m4a'
+            infos.append(info)
+    json.dump(infos, sys.stdout, indent=2)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Record yt-dlp fixtures for the load-test harness.")
+    parser.add_argument('--record', nargs='+', required=True, metavar='URL_OR_QUERY')
+    record(parser.parse_args().record)
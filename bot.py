@@ -2,51 +2,132 @@ import discord
 from discord.ext import commands, tasks
 import os
 from dotenv import load_dotenv
-import yt_dlp
 import asyncio
-import traceback # For detailed error printing
-
-# --- ATTEMPT TO EXPLICITLY LOAD OPUS ---
-# THIS BLOCK IS ADDED AS PER YOUR REQUEST (STEP 2)
-OPUS_LIBS = ['libopus.so.0', 'libopus.so', 'opus'] # Common Linux names for the Opus shared library
-for lib_name in OPUS_LIBS:
-    try:
-        discord.opus.load_opus(lib_name)
-        print(f"DEBUG: Opus library loaded successfully: {lib_name}")
-        break # Exit loop if successfully loaded
-    except discord.opus.OpusNotLoaded:
-        print(f"DEBUG: Opus library '{lib_name}' not found (OpusNotLoaded).")
-    except OSError as e: # Handles cases where file is found but can't be loaded (e.g. wrong architecture)
-        print(f"DEBUG: Opus library '{lib_name}' found but encountered an OSError during load: {e}")
-else: # This 'else' corresponds to the 'for' loop, executes if 'break' was never hit
-    print("CRITICAL DEBUG: FAILED TO LOAD ANY SPECIFIED OPUS LIBRARY. Voice playback will likely fail.")
-# --- END ATTEMPT TO EXPLICITLY LOAD OPUS ---
+import time
+import logging
+import functools
+import glob
+import math
+from resolver import ResolutionCache, stream_url_expiry, normalize_query, is_playlist_url
+from ytdl_pool import YtdlPool, ExtractorBusy
+from audio_cache import AudioCache
+from guild_player import GuildPlayer, Track
+from snapshots import SnapshotStore
+from broadcast import BroadcastHub, BroadcastSource
+from sources import PositionTrackingSource, SilenceSource
+from reconnect import ReconnectScheduler
+import logs
+from metrics import Registry, LoopMonitor, SlowCommandSampler, MetricsServer, count_child_processes
 
+PROCESS_STARTED = time.monotonic()
 
 # --- Configuration ---
 load_dotenv()
 TOKEN = os.getenv('DISCORD_TOKEN')
 PREFIX = "!"
 
-YTDL_FORMAT_OPTIONS = {
+YTDL_FORMAT_OPTIONS = { # Playlists are handled separately with YTDL_PLAYLIST_OVERRIDES
     'format': 'bestaudio/best',
     'outtmpl': '%(extractor)s-%(id)s-%(title)s.%(ext)s',
     'restrictfilenames': True,
     'noplaylist': True,
     'nocheckcertificate': True,
     'ignoreerrors': False,
-    'logtostderr': True,
-    'quiet': False,
-    'no_warnings': True,
+    'quiet': True,
+    'no_warnings': False, # Warnings go to the 'ytdl' logger, which YTDL_LOG_LEVEL filters
+    'logger': logging.getLogger('ytdl'),
     'default_search': 'auto',
     'source_address': '0.0.0.0',
     'cookiefile': 'cookies.txt'
 }
 
+# Per-job overrides for playlist links: list the entries (id, title, URL) without resolving any streams
+YTDL_PLAYLIST_OVERRIDES = {'extract_flat': 'in_playlist', 'noplaylist': False}
+PLAYLIST_FIRST_CHUNK = 25 # Small first page so playback starts quickly; the rest comes in one more extraction
+PLAYLIST_TIMEOUT = float(os.getenv('PLAYLIST_TIMEOUT', '180')) # For that second extraction, which lists up to MAX_PLAYLIST_TRACKS
+MAX_PLAYLIST_TRACKS = int(os.getenv('MAX_PLAYLIST_TRACKS', '5000'))
+MAX_BATCH_QUERIES = 25 # !play with several songs separated by newlines or |
+GUILD_BATCH_LOOKUPS = int(os.getenv('GUILD_BATCH_LOOKUPS', '3'))
+GLOBAL_BATCH_LOOKUPS = int(os.getenv('GLOBAL_BATCH_LOOKUPS', '16'))
+LAZY_RESOLVE_CONCURRENCY = int(os.getenv('LAZY_RESOLVE_CONCURRENCY', '4')) # Placeholder tracks resolved at once, across guilds
+
 FFMPEG_OPTIONS = {
     'before_options': '-reconnect 1 -reconnect_streamed 1 -reconnect_delay_max 5 -analyzeduration 20M -probesize 20M',
     'options': '-vn -loglevel error',
 }
+# When the codec is already known (from yt-dlp or a prefetch probe) ffmpeg doesn't need to sniff 20 MB before starting
+FFMPEG_FAST_BEFORE_OPTIONS = '-reconnect 1 -reconnect_streamed 1 -reconnect_delay_max 5 -analyzeduration 0 -probesize 512k'
+
+PREFETCH_LEAD_SECONDS = float(os.getenv('PREFETCH_LEAD', '15')) # Start the next ffmpeg this long before the current song ends
+PLAYBACK_MODE = os.getenv('PLAYBACK_MODE', 'auto') # 'auto' = pass Opus sources straight through, 'pcm' = always decode + re-encode
+URL_REFRESH_MARGIN = 300 # Re-resolve a queued stream URL if it would expire within this many seconds of its play time
+
+QUEUE_PAGE_SIZE = 10
+
+RECONNECT_PARALLEL = int(os.getenv('RECONNECT_PARALLEL', '5')) # Guilds reconnecting at the same time
+RECONNECT_RATE = float(os.getenv('RECONNECT_RATE', '2')) # Voice connects started per second, across all guilds
+SAFETY_NET_MINUTES = float(os.getenv('SAFETY_NET_MINUTES', '5')) # Sweep for disconnects that no event reported
+
+# Guilds playing the same track share one ffmpeg; a guild more than BROADCAST_BUFFER_SECONDS behind gets its own stream
+BROADCAST_ENABLED = os.getenv('BROADCAST', '1') != '0'
+BROADCAST_BUFFER_SECONDS = float(os.getenv('BROADCAST_BUFFER_SECONDS', '30'))
+BROADCAST_ATTACH_WINDOW = float(os.getenv('BROADCAST_ATTACH_WINDOW', '10')) # Late joiners within this window share the stream from the start
+
+AUDIO_CACHE_DIR = os.getenv('AUDIO_CACHE_DIR') # Unset = no on-disk audio cache
+AUDIO_CACHE_MAX_MB = int(os.getenv('AUDIO_CACHE_MAX_MB', '2048'))
+AUDIO_CACHE_MIN_PLAYS = int(os.getenv('AUDIO_CACHE_MIN_PLAYS', '3'))
+AUDIO_CACHE_POLICY = os.getenv('AUDIO_CACHE_POLICY', 'lru') # 'lru' or 'lfu'
+
+METRICS_PORT = int(os.getenv('METRICS_PORT', '0')) # 0 = no /metrics endpoint; !stats works either way
+METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+SLOW_COMMAND_SECONDS = float(os.getenv('SLOW_COMMAND_SECONDS', '2')) # Commands running longer get their await stack printed; 0 = off
+LOOP_STALL_SECONDS = float(os.getenv('LOOP_STALL_SECONDS', '1')) # Event loop blocked this long dumps its stack; 0 = off
+
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO') # WARNING in production
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'text') # 'text' or 'json'
+YTDL_LOG_LEVEL = os.getenv('YTDL_LOG_LEVEL', 'ERROR') # yt-dlp's own output: DEBUG shows its progress lines, OFF hides everything
+LOG_RATE_LIMIT = int(os.getenv('LOG_RATE_LIMIT', '20')) # Each INFO/DEBUG message at most this many times a minute; 0 = no limit
+
+# Cluster mode: CLUSTER_PROCESSES > 1 makes this process a supervisor running one sharded bot per process (see cluster.py)
+CLUSTER_PROCESSES = int(os.getenv('CLUSTER_PROCESSES', '1')) # Worker processes on this host; ~1 per core
+CLUSTER_HOSTS = int(os.getenv('CLUSTER_HOSTS', '1')) # Hosts sharing the shards; SHARD_COUNT must be set when > 1
+CLUSTER_HOST_INDEX = int(os.getenv('CLUSTER_HOST_INDEX', '0')) # This host's position, 0..CLUSTER_HOSTS-1
+CLUSTER_PORT = int(os.getenv('CLUSTER_PORT', '9108')) # Supervisor's /metrics and /health; workers use the ports after it
+CLUSTER_WORKER = os.getenv('CLUSTER_WORKER') # Set by the supervisor for its workers
+SHARD_COUNT = int(os.getenv('SHARD_COUNT', '0')) # 0 = ask Discord
+SHARD_IDS = [int(i) for i in os.getenv('SHARD_IDS', '').split(',') if i.strip()] # Shards this process runs; empty = unsharded
+
+# Queues, current track/position and stay channels survive restarts; put the file on a persistent volume for deploys
+SNAPSHOT_FILE = os.getenv('SNAPSHOT_FILE', 'player_state.jsonl') # Empty = don't persist
+SNAPSHOT_SECONDS = float(os.getenv('SNAPSHOT_SECONDS', '2')) # Changes reach the file within this long
+SNAPSHOT_POSITION_SECONDS = float(os.getenv('SNAPSHOT_POSITION_SECONDS', '15')) # How stale a saved playback position may get
+SNAPSHOT_MAX_AGE_HOURS = float(os.getenv('SNAPSHOT_MAX_AGE_HOURS', '12')) # Older snapshots are not restored
+
+# --- Logging ---
+LOG_FIELDS = {'worker': int(CLUSTER_WORKER)} if CLUSTER_WORKER else None
+log = logging.getLogger('musicbot')
+glog = logs.GuildLoggers(log) # glog[guild_id].info(...) tags the record with the guild
+
+# --- ATTEMPT TO EXPLICITLY LOAD OPUS ---
+# THIS BLOCK IS ADDED AS PER YOUR REQUEST (STEP 2)
+# Runs on the first voice connect rather than at import, so probing the library names doesn't delay startup
+OPUS_LIBS = ['libopus.so.0', 'libopus.so', 'opus'] # Common Linux names for the Opus shared library
+
+@functools.cache
+def load_opus():
+    if discord.opus.is_loaded(): return True
+    for lib_name in OPUS_LIBS:
+        try:
+            discord.opus.load_opus(lib_name)
+            log.info("Opus library loaded: %s", lib_name)
+            return True
+        except discord.opus.OpusNotLoaded:
+            log.debug("Opus library %r not found (OpusNotLoaded).", lib_name)
+        except OSError as e: # Handles cases where file is found but can't be loaded (e.g. wrong architecture)
+            log.debug("Opus library %r could not be loaded: %s", lib_name, e)
+    log.critical("Failed to load any Opus library. Voice playback will likely fail.")
+    return False
+# --- END ATTEMPT TO EXPLICITLY LOAD OPUS ---
 
 # --- Bot Setup ---
 intents = discord.Intents.default()
@@ -54,159 +135,603 @@ intents.message_content = True
 intents.guilds = True
 intents.voice_states = True
 
-bot = commands.Bot(command_prefix=PREFIX, intents=intents, help_command=None)
+if SHARD_IDS: # A cluster worker: discord.py only sends us events for guilds on these shards
+    bot = commands.AutoShardedBot(command_prefix=PREFIX, intents=intents, help_command=None, shard_ids=SHARD_IDS, shard_count=SHARD_COUNT)
+else:
+    bot = commands.Bot(command_prefix=PREFIX, intents=intents, help_command=None)
 
 # --- Global State for Music ---
 music_queues = {}
 
 def get_guild_state(guild_id):
-    if guild_id not in music_queues:
-        music_queues[guild_id] = {
-            "queue": [], "voice_client": None, "current_song": None,
-            "is_playing": False,
-            "loop_song": False, "loop_queue": False,
-            "keep_alive_active": False, "is_playing_silence": False,
-            "last_channel_id": None, "last_ctx": None
-        }
-    return music_queues[guild_id]
+    state = music_queues.get(guild_id)
+    if state is None:
+        state = music_queues[guild_id] = GuildPlayer(guild_id, lookup_concurrency=GUILD_BATCH_LOOKUPS)
+    return state
+
+# --- Metrics ---
+# Updated on the hot paths below; gauges are only computed when /metrics or !stats asks for them.
+metrics = Registry(prefix="musicbot_")
+EXTRACT_SECONDS = metrics.histogram('extract_seconds', 'yt-dlp extraction time per lookup.')
+FIRST_AUDIO_SECONDS = metrics.histogram('play_to_first_audio_seconds', 'From !play on an idle player to its first audio frame.')
+TRANSITION_GAP_SECONDS = metrics.histogram('transition_gap_seconds', 'From a track stopping to the next one\'s first audio frame.',
+                                           buckets=(0.01, 0.02, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0))
+COMMAND_SECONDS = metrics.histogram('command_seconds', 'Command handler run time.')
+SLOW_COMMANDS = metrics.counter('slow_commands_total', 'Commands that ran longer than SLOW_COMMAND_SECONDS.')
+LOOP_LAG_SECONDS = metrics.histogram('event_loop_lag_seconds', 'How late the event loop woke a sleeping task.',
+                                     buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0))
+loop_monitor = LoopMonitor(LOOP_LAG_SECONDS, stall_threshold=LOOP_STALL_SECONDS)
+command_sampler = SlowCommandSampler(COMMAND_SECONDS, SLOW_COMMANDS, threshold=SLOW_COMMAND_SECONDS)
+
+def health():
+    # Served at /health; the cluster supervisor polls it to know when a worker is up and whether it hangs
+    latency = bot.latency
+    return {
+        "ready": bot.is_ready() and not bot.is_closed(),
+        "latency_ms": round(latency * 1000) if latency == latency and latency != float('inf') else None, # NaN before the first heartbeat
+        "guilds": len(bot.guilds), "shards": SHARD_IDS or None, "voice_clients": len(bot.voice_clients),
+        "loop_lag_ms": round(loop_monitor.last_lag * 1000, 1),
+    }
+
+metrics_server = MetricsServer(metrics, host=METRICS_HOST, port=METRICS_PORT, health=health) if METRICS_PORT else None
+
+# Gauges read the objects defined further down only when scraped
+metrics.gauge('voice_clients', 'Connected voice clients.',
+              lambda: sum(1 for s in music_queues.values() if s.voice_client and s.voice_client.is_connected()))
+metrics.gauge('playing_guilds', 'Guilds playing a song (not silence).', lambda: sum(1 for s in music_queues.values() if s.current_song))
+metrics.gauge('ffmpeg_processes', 'Live ffmpeg child processes.', lambda: count_child_processes('ffmpeg'))
+metrics.gauge('queued_tracks', 'Tracks waiting in all guild queues.', lambda: sum(len(s.queue) for s in music_queues.values()))
+metrics.gauge('longest_queue', 'Length of the longest guild queue.', lambda: max((len(s.queue) for s in music_queues.values()), default=0))
+metrics.gauge('cache_hit_ratio', 'Hit rate of the resolution and audio caches.', label='cache', fn=lambda: {
+    'resolution': resolution_cache.stats()['hit_rate'], 'audio': audio_cache.stats()['hit_rate'] if audio_cache else None})
+metrics.gauge('ytdl_pending', 'Extractions queued or running in the yt-dlp pool.', lambda: ytdl_pool.stats()['pending'])
+metrics.gauge('broadcast_listeners', 'Guilds reading a shared broadcast stream.',
+              lambda: broadcast_hub.stats()['listeners'] if broadcast_hub else None)
+metrics.gauge('reconnects_pending', 'Guilds waiting to reconnect to voice.', lambda: rejoin_scheduler.stats()['pending'])
+metrics.gauge('event_loop_stalls', 'Times the event loop was blocked past LOOP_STALL_SECONDS.', lambda: loop_monitor.stalls)
+metrics.counter_fn('log_records_dropped_total', 'Log records dropped because the log writer thread fell behind.', logs.dropped)
 
 # --- Helper Functions ---
-async def search_youtube(query: str):
+resolution_cache = ResolutionCache(max_entries=int(os.getenv('RESOLUTION_CACHE_SIZE', '512')))
+ytdl_pool = YtdlPool(
+    YTDL_FORMAT_OPTIONS,
+    size=int(os.getenv('YTDL_WORKERS', '0')) or None, # 0 = min(4, CPU count)
+    timeout=float(os.getenv('YTDL_TIMEOUT', '30')),
+    max_pending=int(os.getenv('YTDL_MAX_PENDING', '64')),
+    max_jobs_per_worker=int(os.getenv('YTDL_JOBS_PER_WORKER', '200')),
+    initializer=functools.partial(logs.configure, LOG_LEVEL, LOG_FORMAT, ytdl_level=YTDL_LOG_LEVEL, rate_limit=LOG_RATE_LIMIT, background=False, fields=LOG_FIELDS),
+)
+
+async def _extract_youtube(query: str):
     try:
         is_url = query.startswith("http://") or query.startswith("https://")
         search_target = query if is_url else f"ytsearch:{query}"
-        print(f"DEBUG: yt-dlp processing target: {search_target} with cookiefile: {YTDL_FORMAT_OPTIONS.get('cookiefile')}")
-        with yt_dlp.YoutubeDL(YTDL_FORMAT_OPTIONS) as ydl:
-            loop = asyncio.get_event_loop()
-            def extract_info_sync():
-                return ydl.extract_info(search_target, download=False)
-            info = await loop.run_in_executor(None, extract_info_sync)
-            if not info:
-                print(f"DEBUG: yt-dlp returned no info for: {search_target}")
-                return None
-            data_to_use = None
-            if 'entries' in info and info['entries']: data_to_use = info['entries'][0]
-            elif 'url' in info and 'title' in info: data_to_use = info
-            else:
-                print(f"DEBUG: yt-dlp extracted data in unexpected format for '{search_target}'.")
-                return None
-            if not data_to_use or 'url' not in data_to_use or 'title' not in data_to_use:
-                print(f"DEBUG: yt-dlp extracted data missing 'url' or 'title'.")
-                return None
-            print(f"DEBUG: Successfully extracted - Title: {data_to_use['title']}")
-            return {"source": data_to_use['url'], "title": data_to_use['title']}
-    except Exception as e:
-        print(f"CRITICAL Error in search_youtube for '{query}': {e}")
-        traceback.print_exc()
+        log.debug("yt-dlp processing target: %s", search_target)
+        kind, started = ("url" if is_url else "search"), time.perf_counter()
+        try: info = await ytdl_pool.extract(search_target)
+        except ExtractorBusy: raise # Turned away without running, so not an extraction time
+        except Exception:
+            EXTRACT_SECONDS.observe(time.perf_counter() - started, kind=kind, outcome="error")
+            raise
+        EXTRACT_SECONDS.observe(time.perf_counter() - started, kind=kind, outcome="ok")
+        if not info:
+            log.info("yt-dlp returned no info for: %s", search_target)
+            return None
+        data_to_use = None
+        if 'entries' in info and info['entries']: data_to_use = info['entries'][0]
+        elif 'url' in info and 'title' in info: data_to_use = info
+        else:
+            log.warning("yt-dlp extracted data in unexpected format for %r.", search_target)
+            return None
+        if not data_to_use or 'url' not in data_to_use or 'title' not in data_to_use:
+            log.warning("yt-dlp extracted data missing 'url' or 'title' for %r.", search_target)
+            return None
+        log.debug("Extracted %r", data_to_use['title'])
+        return {
+            "id": data_to_use.get('id'), "source": data_to_use['url'], "title": data_to_use['title'], "page_url": data_to_use.get('webpage_url'),
+            "duration": data_to_use.get('duration'), "acodec": data_to_use.get('acodec'), "abr": data_to_use.get('abr'),
+        }
+    except ExtractorBusy:
+        raise # Let the command tell the user to back off instead of reporting "not found"
+    except Exception:
+        log.exception("Extraction failed for %r", query)
         return None
 
-async def play_song_in_vc(guild_id, song_info):
+async def search_youtube(query: str):
+    # Identical lookups (even from different guilds) share one extraction while the stream URL is still valid
+    song_info = await resolution_cache.resolve(query, lambda: _extract_youtube(query))
+    if not song_info: return None
+    if log.isEnabledFor(logging.DEBUG): log.debug("Resolution cache stats: %s", resolution_cache.stats())
+    return Track.from_info(song_info)
+
+audio_cache = None # Built by setup(), only in the process that owns the cache directory
+
+def cached_audio_path(song_info):
+    return audio_cache.lookup(song_info.id) if audio_cache else None
+
+def is_opus_source(song_info):
+    return (song_info.acodec or "").lower().startswith("opus")
+
+broadcast_hub = BroadcastHub(buffer_seconds=BROADCAST_BUFFER_SECONDS, attach_window=BROADCAST_ATTACH_WINDOW) if BROADCAST_ENABLED else None
+
+def create_ffmpeg_player(song_info, start=0.0, force_opus=False):
+    seek = f"-ss {start:.2f} " if start else ""
+    local_path = cached_audio_path(song_info)
+    if local_path:
+        if PLAYBACK_MODE == 'pcm' and not force_opus: return discord.FFmpegPCMAudio(local_path, before_options=seek or None, options=FFMPEG_OPTIONS['options'])
+        return discord.FFmpegOpusAudio(local_path, codec='copy', before_options=seek or None, options=FFMPEG_OPTIONS['options'])
+    known_codec = song_info.acodec not in (None, "none")
+    before_options = seek + (FFMPEG_FAST_BEFORE_OPTIONS if known_codec else FFMPEG_OPTIONS['before_options'])
+    if force_opus or (PLAYBACK_MODE != 'pcm' and is_opus_source(song_info)):
+        # For Opus sources ffmpeg only remuxes the packets; discord.py sends them as-is without decoding or re-encoding
+        codec = 'copy' if is_opus_source(song_info) else 'libopus'
+        return discord.FFmpegOpusAudio(song_info.source, codec=codec, before_options=before_options, options=FFMPEG_OPTIONS['options'])
+    return discord.FFmpegPCMAudio(song_info.source, before_options=before_options, options=FFMPEG_OPTIONS['options'])
+
+def create_player(song_info, start=0.0):
+    if broadcast_hub and song_info.id and PLAYBACK_MODE != 'pcm': # 'pcm' is the decode + re-encode fallback, so it can't share Opus
+        # Shared producers have to emit Opus packets, so non-Opus sources are encoded once by ffmpeg for every listener
+        return broadcast_hub.open(song_info.id, lambda offset: create_ffmpeg_player(song_info, offset, force_opus=True), start=start)
+    return create_ffmpeg_player(song_info, start)
+
+def format_duration(seconds):
+    seconds = int(seconds or 0)
+    hours, rem = divmod(seconds, 3600)
+    return f"{hours}:{rem // 60:02d}:{rem % 60:02d}" if hours else f"{rem // 60}:{rem % 60:02d}"
+
+def parse_timestamp(text):
+    """'90', '1:30' or '1:01:30' -> seconds; None if it isn't a timestamp."""
+    try: parts = [float(p) for p in text.strip().split(':')]
+    except ValueError: return None
+    if not 1 <= len(parts) <= 3 or not all(math.isfinite(p) and p >= 0 for p in parts): return None # float() takes 'nan' and 'inf'
+    seconds = 0.0
+    for part in parts: seconds = seconds * 60 + part
+    return seconds if math.isfinite(seconds) else None
+
+def progress_bar(position, duration, width=20):
+    if not duration: return f"{format_duration(position)} / live"
+    filled = min(width - 1, int(width * position / duration))
+    return f"{'▬' * filled}🔘{'▬' * (width - 1 - filled)} {format_duration(position)} / {format_duration(duration)}"
+
+def player_alive(player):
+    if isinstance(player, BroadcastSource): return player.alive()
+    process = getattr(player, '_process', None)
+    return bool(process) and process.poll() is None
+
+lazy_resolve_slots = asyncio.Semaphore(LAZY_RESOLVE_CONCURRENCY)
+
+async def ensure_resolved(song_info):
+    """Resolves a playlist placeholder's stream URL in place; returns False if it can't be played."""
+    if song_info.resolved: return True
+    if not song_info.lookup_url: return False
+    async with lazy_resolve_slots:
+        if song_info.resolved: return True # Prefetch and playback may race for the same placeholder
+        fresh = await search_youtube(song_info.lookup_url)
+    if fresh: song_info.update(fresh)
+    return song_info.resolved
+
+async def refresh_stream_url(song_info, plays_in=0.0):
+    if not song_info.resolved: return
+    expiry = stream_url_expiry(song_info.source)
+    if expiry is None or expiry - time.time() > plays_in + URL_REFRESH_MARGIN: return
+    if not song_info.lookup_url: return
+    log.debug("Stream URL for %r expires soon, re-resolving.", song_info.title)
+    resolution_cache.invalidate(normalize_query(song_info.lookup_url))
+    fresh = await search_youtube(song_info.lookup_url)
+    if fresh: song_info.update(fresh) # In place, so the queue entry itself is refreshed
+
+async def probe_stream(song_info):
+    if song_info.acodec not in (None, "none"): return
+    try:
+        proc = await asyncio.create_subprocess_exec(
+            'ffprobe', '-v', 'error', '-select_streams', 'a:0', '-show_entries', 'stream=codec_name,bit_rate',
+            '-of', 'default=noprint_wrappers=1', song_info.source,
+            stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.DEVNULL)
+        out, _ = await asyncio.wait_for(proc.communicate(), timeout=10)
+    except (OSError, asyncio.TimeoutError) as e:
+        log.warning("ffprobe failed for %r: %s", song_info.title, e)
+        return
+    fields = dict(line.split('=', 1) for line in out.decode(errors='ignore').splitlines() if '=' in line)
+    if fields.get('codec_name'): song_info.acodec = fields['codec_name']
+    if fields.get('bit_rate', '').isdigit(): song_info.abr = int(fields['bit_rate']) / 1000
+
+def discard_prefetch(state):
+    task = state.prefetch_task
+    if task and not task.done() and task is not asyncio.current_task(): task.cancel()
+    state.prefetch_task = None
+    if state.prefetched:
+        state.prefetched[1].cleanup() # Kills the warmed-up ffmpeg process
+        state.prefetched = None
+
+def cancel_ingest(state):
+    if state.ingest_task and not state.ingest_task.done(): state.ingest_task.cancel()
+    state.ingest_task = None
+
+def take_prefetched_player(state, song_info):
+    prefetched, state.prefetched = state.prefetched, None
+    if not prefetched: return None
+    prefetched_song, player = prefetched
+    if prefetched_song is not song_info or not player_alive(player):
+        player.cleanup()
+        return None
+    return player
+
+def schedule_prefetch(guild_id):
+    state = get_guild_state(guild_id)
+    discard_prefetch(state)
+    if state.current_song and state.queue:
+        state.prefetch_task = bot.loop.create_task(prefetch_next(guild_id, state.current_song))
+
+async def prefetch_next(guild_id, current_song):
     state = get_guild_state(guild_id)
-    if not state["voice_client"] or not state["voice_client"].is_connected():
-        state["is_playing"] = False
-        state["current_song"] = None
-        print(f"[{guild_id}] play_song_in_vc: VC not connected. Aborting play.")
+    next_song = None
+    duration = current_song.duration or 0
+    try:
+        if not state.queue: return # Emptied (!stop, !clear) before this task got to run
+        next_song = state.queue[0]
+        remaining = max(0.0, duration - state.position)
+        cached = audio_cache and next_song.id in audio_cache
+        if not cached:
+            if not await ensure_resolved(next_song): return
+            await refresh_stream_url(next_song, plays_in=remaining)
+            await probe_stream(next_song)
+        if not duration: return # Unknown length, so no safe moment to warm ffmpeg up
+        while state.current_song is current_song:
+            remaining = duration - state.position # Counted from frames played, so time spent paused doesn't count
+            if remaining <= PREFETCH_LEAD_SECONDS: break
+            await asyncio.sleep(remaining - PREFETCH_LEAD_SECONDS)
+        if state.current_song is not current_song or not state.queue or state.queue[0] is not next_song: return
+        state.prefetched = (next_song, create_player(next_song))
+        glog[guild_id].debug("Prefetched next track: %s", next_song.title)
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        glog[guild_id].warning("Prefetch failed for %r: %s", next_song.title if next_song else None, e)
+
+async def prepare_stream(state, song_info):
+    """Resolves, refreshes and probes `song_info`; returns False if it can't be played. Callers hold the guild's lock."""
+    # That can take ~40 s; the lock is let go meanwhile so !stop, !leave and the rest don't wait behind it
+    state.lock.release()
+    try:
+        if not await ensure_resolved(song_info): return False
+        await refresh_stream_url(song_info)
+        if PLAYBACK_MODE != 'pcm': await probe_stream(song_info) # No-op when yt-dlp already reported the codec
+        return True
+    finally:
+        await reacquire(state.lock)
+
+async def reacquire(lock):
+    # The caller's `async with` releases the lock again on the way out, so it must be held even if we're cancelled
+    cancelled = False
+    while True:
+        try:
+            await lock.acquire()
+            break
+        except asyncio.CancelledError:
+            cancelled = True
+    if cancelled: raise asyncio.CancelledError
+
+async def play_song_in_vc(guild_id, song_info, player=None, start=0.0, announce=True):
+    state = get_guild_state(guild_id)
+    if not state.voice_client or not state.voice_client.is_connected():
+        state.is_playing = False
+        state.current_song = None
+        state.current_source = None
+        if player: player.cleanup()
+        glog[guild_id].info("Voice client not connected; not playing %r.", song_info.title)
         return
 
-    state["current_song"] = song_info
-    state["is_playing_silence"] = False
-    state["is_playing"] = True
-    print(f"[{guild_id}] Attempting to play: {song_info['title']}")
+    stop_silence(state)
+    state.current_song = song_info
+    state.is_playing = True
+    glog[guild_id].debug("Attempting to play: %s", song_info.title)
     try:
-        player = discord.FFmpegPCMAudio(song_info['source'], **FFMPEG_OPTIONS)
-        state["voice_client"].play(player, after=lambda e: asyncio.run_coroutine_threadsafe(song_finished_callback(e, guild_id), bot.loop))
-        print(f"[{guild_id}] DISCORD.PY .play() CALLED for: {song_info['title']}")
-        if state["last_ctx"]:
-            try: await state["last_ctx"].send(f"Now playing: **{song_info['title']}**")
-            except Exception as send_err: print(f"[{guild_id}] Error sending 'Now playing' msg: {send_err}")
+        if player is None:
+            if not (audio_cache and song_info.id in audio_cache):
+                playable = await prepare_stream(state, song_info)
+                vc = state.voice_client
+                if state.current_song is not song_info or (vc and (vc.is_playing() or vc.is_paused())):
+                    glog[guild_id].debug("%r was stopped or replaced while it loaded.", song_info.title)
+                    return
+                if not (vc and vc.is_connected()):
+                    state.is_playing = False # Kept as current_song, so a rejoin resumes it
+                    glog[guild_id].info("Voice disconnected while %r loaded.", song_info.title)
+                    return
+                if not playable:
+                    glog[guild_id].warning("Could not resolve %r, skipping.", song_info.title)
+                    state.is_playing = False
+                    state.current_song = None
+                    state.current_source = None
+                    if state.last_ctx:
+                        try: await state.last_ctx.send(f"Skipping **{song_info.title}**: it could not be loaded.")
+                        except Exception as send_err: glog[guild_id].warning("Error sending skip message: %s", send_err)
+                    asyncio.run_coroutine_threadsafe(song_finished_callback(None, guild_id), bot.loop)
+                    return
+            player = create_player(song_info, start)
+        if audio_cache and not start and audio_cache.record_play(song_info.id):
+            bot.loop.create_task(audio_cache.store(song_info.id, song_info.source, is_opus_source(song_info)))
+        source = state.current_source = PositionTrackingSource(player, start, on_start=lambda: record_first_audio(state))
+        state.resume_position = 0.0
+        state.voice_client.play(source, after=lambda e: asyncio.run_coroutine_threadsafe(song_finished_callback(e, guild_id, source), bot.loop))
+        mark_snapshot(guild_id)
+        schedule_prefetch(guild_id)
+        glog[guild_id].info("Playing %r from %s", song_info.title, format_duration(start))
+        if state.last_ctx and announce:
+            try: await state.last_ctx.send(f"Now playing: **{song_info.title}**")
+            except Exception as send_err: glog[guild_id].warning("Error sending 'Now playing' message: %s", send_err)
     except Exception as e:
-        print(f"[{guild_id}] Error in play_song_in_vc for {song_info.get('title', 'unknown')}: {e}")
-        traceback.print_exc()
-        state["is_playing"] = False
-        state["current_song"] = None
+        glog[guild_id].exception("Error playing %r", song_info.title)
+        state.is_playing = False
+        state.current_song = None
+        state.current_source = None
         asyncio.run_coroutine_threadsafe(song_finished_callback(e, guild_id), bot.loop)
 
-async def song_finished_callback(error, guild_id):
+def record_first_audio(state):
+    # Runs on discord.py's audio thread at a track's first frame; only reads and clears two timestamps
+    now = time.monotonic()
+    requested, state.play_requested_at = state.play_requested_at, None
+    if requested: FIRST_AUDIO_SECONDS.observe(now - requested)
+    stopped, state.transition_started_at = state.transition_started_at, None
+    if stopped: TRANSITION_GAP_SECONDS.observe(now - stopped)
+
+async def song_finished_callback(error, guild_id, source=None):
+    state = get_guild_state(guild_id)
+    async with state.lock:
+        if source is not None and source is not state.current_source:
+            return # A source we replaced ourselves (seek, rejoin) finishing late; the queue must not advance
+        vc = state.voice_client
+        if source is not None and state.current_song and state.last_channel_id and not (vc and vc.is_connected()):
+            # Stopped because the voice connection dropped, not because the song ended: keep it for attempt_rejoin
+            glog[guild_id].info("Voice disconnected during %r at %s; holding for rejoin.", state.current_song.title, format_duration(state.position))
+            state.is_playing = False
+            rejoin_scheduler.request(guild_id)
+            return
+        if source is not None: state.transition_started_at = source.stopped_at or time.monotonic()
+        await start_next_song(guild_id, error)
+
+async def start_next_song(guild_id, error=None):
+    # Callers must hold the guild's lock; commands that already do call this instead of song_finished_callback
     state = get_guild_state(guild_id)
-    print(f"[{guild_id}] song_finished_callback triggered. Error: {error}")
-    current_title = state["current_song"]["title"] if state["current_song"] else "N/A (already cleared or never set)"
-    print(f"[{guild_id}] Song '{current_title}' finished or was stopped.")
+    transition_started = time.monotonic()
+    if error: glog[guild_id].warning("Playback of %r stopped with error: %s", state.current_song.title if state.current_song else None, error)
+    else: glog[guild_id].debug("Song %r finished or was stopped.", state.current_song.title if state.current_song else None)
 
-    state["current_song"] = None
-    state["is_playing"] = False
+    state.current_song = None
+    state.current_source = None
+    state.is_playing = False
+    mark_snapshot(guild_id)
 
-    if state["queue"]:
-        next_song_info = state["queue"].pop(0)
-        print(f"[{guild_id}] Playing next from queue: {next_song_info['title']}")
-        await play_song_in_vc(guild_id, next_song_info)
+    if state.queue:
+        next_song_info = state.pop_next()
+        player = take_prefetched_player(state, next_song_info)
+        discard_prefetch(state)
+        glog[guild_id].debug("Playing next from queue: %s (prefetched: %s)", next_song_info.title, player is not None)
+        await play_song_in_vc(guild_id, next_song_info, player=player)
+        if state.current_song is next_song_info:
+            state.last_transition_ms = (time.monotonic() - transition_started) * 1000
+            glog[guild_id].debug("Time to next audio: %.0f ms", state.last_transition_ms)
     else:
-        print(f"[{guild_id}] Queue is empty. Playback ended.")
-        if state["keep_alive_active"]:
-            print(f"[{guild_id}] Stay mode active, checking for silent audio.")
+        discard_prefetch(state)
+        state.play_requested_at = state.transition_started_at = None # Nothing is coming to measure against
+        glog[guild_id].info("Queue is empty. Playback ended.")
+        if state.keep_alive_active:
+            glog[guild_id].debug("Stay mode active, checking for silent audio.")
             await play_silent_audio_if_needed(guild_id)
 
 async def play_silent_audio_if_needed(guild_id):
     state = get_guild_state(guild_id)
-    if state["keep_alive_active"] and \
-       state["voice_client"] and state["voice_client"].is_connected() and \
-       not state["is_playing"] and not state["queue"] and not state["current_song"]:
-        print(f"[{guild_id}] Playing conceptual silent audio.")
-        state["is_playing_silence"] = True
-        state["is_playing"] = True
-        # Placeholder - real silent audio stream would have an 'after' callback
-        # For now, keep_alive_task will re-evaluate
-    # else:
-    #    state["is_playing_silence"] = False # ensure it's reset
+    vc = state.voice_client
+    if state.keep_alive_active and vc and vc.is_connected() and \
+       not state.is_playing and not state.is_playing_silence and not state.queue and not state.current_song and \
+       not vc.is_playing() and not vc.is_paused():
+        glog[guild_id].debug("Playing silent audio to stay connected.")
+        source = state.silence_source = SilenceSource()
+        state.is_playing_silence = True
+        vc.play(source, after=lambda e: asyncio.run_coroutine_threadsafe(silence_finished_callback(e, guild_id, source), bot.loop))
 
-async def attempt_rejoin(guild_id):
+def stop_silence(state):
+    # Callers then start a song right away; clearing silence_source first makes the silence after-hook a no-op
+    if not state.silence_source: return
+    state.silence_source = None
+    state.is_playing_silence = False
+    if state.voice_client and state.voice_client.is_playing(): state.voice_client.stop()
+
+async def silence_finished_callback(error, guild_id, source):
     state = get_guild_state(guild_id)
-    if state["last_channel_id"]:
-        channel = bot.get_channel(state["last_channel_id"])
-        if channel and isinstance(channel, discord.VoiceChannel):
-            print(f"[{guild_id}] Attempting to rejoin channel: {channel.name}")
-            try:
-                if state["voice_client"] and state["voice_client"].is_connected():
-                    await state["voice_client"].disconnect(force=True)
-                state["voice_client"] = await channel.connect(timeout=10.0, reconnect=True)
-                print(f"[{guild_id}] Rejoined {channel.name}. Checking playback status.")
-                if state["current_song"]:
-                    temp_song = state["current_song"]
-                    state["current_song"] = None; state["is_playing"] = False
-                    await play_song_in_vc(guild_id, temp_song)
-                elif state["queue"]:
-                    await song_finished_callback(None, guild_id)
-                elif state["keep_alive_active"]:
-                    await play_silent_audio_if_needed(guild_id)
-            except Exception as e:
-                print(f"[{guild_id}] Error during rejoin: {e}")
-                state["voice_client"] = None
+    async with state.lock:
+        if source is not state.silence_source: return # Replaced by a song (stop_silence) or already handled
+        state.silence_source = None
+        state.is_playing_silence = False
+        if error: glog[guild_id].warning("Silent audio stopped with error: %s", error)
+        vc = state.voice_client
+        if not (vc and vc.is_connected()):
+            if state.keep_alive_active and state.last_channel_id: rejoin_scheduler.request(guild_id)
+        elif state.queue:
+            await start_next_song(guild_id)
         else:
-            state["keep_alive_active"] = False
+            await play_silent_audio_if_needed(guild_id)
+
+async def attempt_rejoin(guild_id):
+    async with get_guild_state(guild_id).lock:
+        return await _attempt_rejoin(guild_id)
+
+def abandon_player(state):
+    # Rejoining is no longer possible: drop what was waiting for it, or snapshots would bring it back after every restart
+    state.keep_alive_active = False
+    state.queue.clear()
+    cancel_ingest(state)
+    discard_prefetch(state)
+    state.current_song = None
+    state.current_source = None
+    state.is_playing = False
+    state.resume_position = 0.0
+    state.last_channel_id = None
+    mark_snapshot(state.guild_id)
+
+async def give_up_rejoin(guild_id):
+    state = get_guild_state(guild_id)
+    async with state.lock:
+        if not (state.voice_client and state.voice_client.is_connected()): abandon_player(state)
+
+async def _attempt_rejoin(guild_id):
+    # Returns True once nothing is left to do (connected, or stay mode/playback no longer wants the channel)
+    state = get_guild_state(guild_id)
+    if not state.last_channel_id or not (state.keep_alive_active or state.current_song or state.queue):
+        state.keep_alive_active = False
+        return True
+    channel = bot.get_channel(state.last_channel_id)
+    if not (channel and isinstance(channel, discord.VoiceChannel)):
+        glog[guild_id].info("Voice channel %s is gone; dropping the player state.", state.last_channel_id)
+        abandon_player(state)
+        return True
+    guild_vc = channel.guild.voice_client
+    if guild_vc and guild_vc.is_connected() and guild_vc.channel == channel:
+        # discord.py's own reconnect got there first; just pick playback back up
+        state.voice_client = guild_vc
+        glog[guild_id].info("Voice already reconnected to %s. Checking playback status.", channel.name)
     else:
-        state["keep_alive_active"] = False
+        glog[guild_id].info("Attempting to rejoin channel: %s", channel.name)
+        try:
+            if guild_vc: await guild_vc.disconnect(force=True)
+            load_opus()
+            state.voice_client = await channel.connect(timeout=10.0, reconnect=True)
+        except Exception as e:
+            glog[guild_id].warning("Error during rejoin: %s", e)
+            state.voice_client = None
+            return False
+        glog[guild_id].info("Rejoined %s. Checking playback status.", channel.name)
+    # Resuming may have to resolve the track again; that happens outside the scheduler's slot so other guilds can connect
+    bot.loop.create_task(resume_after_rejoin(guild_id))
+    return True
+
+async def resume_after_rejoin(guild_id):
+    state = get_guild_state(guild_id)
+    async with state.lock:
+        vc = state.voice_client
+        if not (vc and vc.is_connected()) or vc.is_playing() or vc.is_paused(): return
+        if state.current_song:
+            # Resume where we were with an input seek instead of restarting (and re-downloading) the song
+            temp_song, position = state.current_song, state.position
+            state.current_song = None; state.current_source = None; state.is_playing = False
+            await play_song_in_vc(guild_id, temp_song, start=position, announce=False)
+            glog[guild_id].info("Resumed %r at %s after rejoin.", temp_song.title, format_duration(position))
+        elif state.queue:
+            await start_next_song(guild_id)
+        elif state.keep_alive_active:
+            state.silence_source = None; state.is_playing_silence = False # The old connection took its silence source with it
+            await play_silent_audio_if_needed(guild_id)
+
+rejoin_scheduler = ReconnectScheduler(attempt_rejoin, max_parallel=RECONNECT_PARALLEL, connects_per_second=RECONNECT_RATE, give_up=give_up_rejoin)
+
+# --- Snapshots ---
+# Whatever changes a guild's queue, current track, loop flags or stay channel calls mark_snapshot(); the store
+# writes marked guilds a couple of seconds later. On startup, on_ready restores them and the rejoin scheduler
+# reconnects them, with its usual cap on parallel connects.
+
+def capture_snapshot(guild_id):
+    state = music_queues.get(guild_id)
+    if state is None or not state.last_channel_id or not (state.keep_alive_active or state.current_song or state.queue): return None
+    record = {"channel": state.last_channel_id}
+    if state.text_channel_id: record["text_channel"] = state.text_channel_id
+    if state.keep_alive_active: record["stay"] = True
+    if state.loop_song: record["loop_song"] = True
+    if state.loop_queue: record["loop_queue"] = True
+    if state.current_song:
+        record["current"] = state.current_song.snapshot()
+        record["position"] = round(state.position, 1)
+    if state.queue: record["queue"] = [track.snapshot() for track in state.queue]
+    return record
+
+snapshot_store = None # Built by setup()
+snapshot_restored = False
+
+def mark_snapshot(guild_id):
+    if snapshot_store: snapshot_store.mark(guild_id)
+
+async def restore_snapshots():
+    records = await bot.loop.run_in_executor(None, snapshot_store.load)
+    restored = 0
+    for guild_id, record in records.items():
+        if not bot.get_guild(guild_id): continue # We left it, or its shard belongs to another cluster worker
+        state = get_guild_state(guild_id)
+        if state.voice_client or state.current_song or state.queue: continue # Someone used the bot before we got here
+        state.last_channel_id = record["channel"]
+        state.keep_alive_active = record.get("stay", False)
+        state.loop_song = record.get("loop_song", False)
+        state.loop_queue = record.get("loop_queue", False)
+        state.text_channel_id = record.get("text_channel")
+        state.last_ctx = bot.get_channel(state.text_channel_id or 0) # Only .send() is used on last_ctx, which a channel has too
+        state.enqueue_many(Track.from_snapshot(t) for t in record.get("queue", ()))
+        if record.get("current"):
+            state.current_song = Track.from_snapshot(record["current"])
+            state.resume_position = record.get("position", 0.0) # _attempt_rejoin resumes from here
+        mark_snapshot(guild_id)
+        rejoin_scheduler.request(guild_id, delay=0)
+        restored += 1
+    if restored:
+        log.info("Restored player state for %d guild(s); reconnecting.", restored)
+        bot.loop.create_task(ytdl_pool.start()) # Restored tracks need re-resolving; warm the extractors while voice connects
+
+def snapshot_positions():
+    # A held (disconnected) song's position isn't moving; its record already has it
+    return {guild_id: round(state.position, 1) for guild_id, state in music_queues.items() if state.current_song and state.is_playing}
 
 # --- Bot Events ---
 @bot.event
 async def on_ready():
-    print(f'{bot.user.name} has connected to Discord!')
+    global snapshot_restored
+    log.info("%s has connected to Discord! (%.1fs after start)", bot.user.name, time.monotonic() - PROCESS_STARTED)
     if not keep_alive_task.is_running():
         keep_alive_task.start()
+    if snapshot_store and not snapshot_restored: # on_ready fires again after a gateway re-identify; restore only once
+        snapshot_restored = True
+        try: await restore_snapshots()
+        except Exception: log.exception("Could not restore player snapshots")
+        snapshot_store.start()
+    loop_monitor.start()
+    if metrics_server:
+        try: await metrics_server.start()
+        except OSError as e: log.error("Could not start metrics endpoint on %s:%d: %s", METRICS_HOST, METRICS_PORT, e)
+
+@bot.before_invoke
+async def before_any_command(ctx):
+    command_sampler.before(ctx)
+    if ctx.guild: get_guild_state(ctx.guild.id).text_channel_id = ctx.channel.id
 
-@tasks.loop(seconds=30)
+@bot.after_invoke
+async def after_any_command(ctx):
+    command_sampler.after(ctx)
+    if ctx.guild: mark_snapshot(ctx.guild.id) # Any command may have changed the queue, loop flags or stay mode
+
+@bot.event
+async def on_voice_state_update(member, before, after):
+    if not bot.user or member.id != bot.user.id or before.channel == after.channel: return
+    state = music_queues.get(member.guild.id)
+    if state is None: return
+    if after.channel is not None:
+        state.last_channel_id = after.channel.id # Moved (possibly dragged by a moderator): rejoin there from now on
+        mark_snapshot(member.guild.id)
+        return
+    if state.last_channel_id and (state.keep_alive_active or state.current_song or state.queue):
+        glog[member.guild.id].info("Voice disconnected from %s; scheduling reconnect.", before.channel)
+        rejoin_scheduler.request(member.guild.id)
+
+# Reconnects are event driven (see on_voice_state_update); this slow sweep only catches anything an event missed
+@tasks.loop(minutes=SAFETY_NET_MINUTES)
 async def keep_alive_task():
     for guild_id, state in list(music_queues.items()):
-        if state.get("keep_alive_active"):
-            if state.get("voice_client") and state["voice_client"].is_connected():
-                if not state.get("is_playing") and not state.get("queue") and not state.get("current_song"):
+        if state.keep_alive_active:
+            if state.voice_client and state.voice_client.is_connected():
+                if not state.is_playing and not state.queue and not state.current_song:
                     await play_silent_audio_if_needed(guild_id)
-            elif state.get("last_channel_id"): # Disconnected but should be active
-                await attempt_rejoin(guild_id)
+            elif state.last_channel_id: # Disconnected but should be active
+                rejoin_scheduler.request(guild_id, delay=0)
 
 @keep_alive_task.before_loop
 async def before_keep_alive_task():
     await bot.wait_until_ready()
 
-# --- Music Commands (join, stay, leave, play, skip, stop, pause, resume, queue) ---
+# --- Music Commands (join, stay, leave, play, skip, stop, pause, resume, seek, nowplaying, queue, remove, move, shuffle) ---
 # These commands will remain largely the same as the previous "full code" version,
 # but ensure they use `get_guild_state(ctx.guild.id)` correctly.
 # I will paste them for completeness.
@@ -214,225 +739,474 @@ async def before_keep_alive_task():
 @bot.command(name='join', help='Tells the bot to join the voice channel you are in.')
 async def join(ctx):
     state = get_guild_state(ctx.guild.id)
-    state["last_ctx"] = ctx 
+    state.last_ctx = ctx 
     if not ctx.author.voice:
         await ctx.send(f"{ctx.author.mention} is not connected to a voice channel.")
         return
     channel = ctx.author.voice.channel
-    state["last_channel_id"] = channel.id
-    if state["voice_client"] and state["voice_client"].is_connected():
-        if state["voice_client"].channel == channel: await ctx.send("I'm already in this voice channel!")
+    state.last_channel_id = channel.id
+    if state.voice_client and state.voice_client.is_connected():
+        if state.voice_client.channel == channel: await ctx.send("I'm already in this voice channel!")
         else:
-            await state["voice_client"].move_to(channel)
+            await state.voice_client.move_to(channel)
             await ctx.send(f"Moved to **{channel.name}**.")
     else:
         try:
-            state["voice_client"] = await channel.connect(timeout=10.0, reconnect=True)
+            load_opus()
+            state.voice_client = await channel.connect(timeout=10.0, reconnect=True)
             await ctx.send(f"Joined **{channel.name}**.")
         except Exception as e:
             await ctx.send(f"Could not join **{channel.name}**: {e}")
-            if state["voice_client"]:
-                try: await state["voice_client"].disconnect(force=True)
+            if state.voice_client:
+                try: await state.voice_client.disconnect(force=True)
                 except: pass
-            state["voice_client"] = None
+            state.voice_client = None
 
 @bot.command(name='stay', help='Tells the bot to join and stay in your current VC 24/7.')
 async def stay(ctx):
     state = get_guild_state(ctx.guild.id)
-    state["last_ctx"] = ctx
-    state["keep_alive_active"] = True
+    state.last_ctx = ctx
+    state.keep_alive_active = True
     if not ctx.author.voice:
         await ctx.send(f"{ctx.author.mention} is not connected to a voice channel.")
-        state["keep_alive_active"] = False
+        state.keep_alive_active = False
         return
-    state["last_channel_id"] = ctx.author.voice.channel.id
+    state.last_channel_id = ctx.author.voice.channel.id
     await join(ctx) # Let join handle connection logic
-    if state["voice_client"] and state["voice_client"].is_connected():
+    if state.voice_client and state.voice_client.is_connected():
         await ctx.send("Okay, I will try to stay in this channel.")
-        if not state["is_playing"] and not state["queue"] and not state["current_song"]: # Check if something should start
+        if not state.is_playing and not state.queue and not state.current_song: # Check if something should start
             await play_silent_audio_if_needed(ctx.guild.id)
-        elif not state["is_playing"] and (state["queue"] or state["current_song"]):
+        elif not state.is_playing and (state.queue or state.current_song):
              await song_finished_callback(None, ctx.guild.id) # Trigger play if queue has items
     else:
-        state["keep_alive_active"] = False # Join failed
+        state.keep_alive_active = False # Join failed
 
 @bot.command(name='leave', help='To make the bot leave the voice channel.')
 async def leave(ctx):
     state = get_guild_state(ctx.guild.id)
-    state["last_ctx"] = ctx
-    if state["voice_client"] and state["voice_client"].is_connected():
-        state["keep_alive_active"] = False
-        state["is_playing_silence"] = False
-        state["queue"].clear()
-        state["current_song"] = None
-        state["is_playing"] = False
-        if state["voice_client"].is_playing() or state["voice_client"].is_paused():
-            state["voice_client"].stop()
-        await state["voice_client"].disconnect()
-        state["voice_client"] = None
-        state["last_channel_id"] = None
-        await ctx.send("Left the voice channel.")
-    else:
-        await ctx.send("I am not in a voice channel.")
+    state.last_ctx = ctx
+    async with state.lock:
+        if state.voice_client and state.voice_client.is_connected():
+            state.keep_alive_active = False
+            stop_silence(state)
+            state.queue.clear()
+            cancel_ingest(state)
+            discard_prefetch(state)
+            state.current_song = None
+            state.current_source = None
+            state.is_playing = False
+            state.last_channel_id = None # Before disconnecting, so on_voice_state_update doesn't schedule a rejoin
+            rejoin_scheduler.cancel(ctx.guild.id)
+            if state.voice_client.is_playing() or state.voice_client.is_paused():
+                state.voice_client.stop()
+            await state.voice_client.disconnect()
+            state.voice_client = None
+            await ctx.send("Left the voice channel.")
+        else:
+            await ctx.send("I am not in a voice channel.")
 
-@bot.command(name='play', aliases=['p'], help='Plays a song from YouTube (URL or search query)')
+@bot.command(name='play', aliases=['p'], help='Plays a song from YouTube (URL, playlist or search query). Separate several songs with new lines or |.')
 async def play(ctx, *, query: str):
     state = get_guild_state(ctx.guild.id)
-    state["last_ctx"] = ctx
+    state.last_ctx = ctx
+    if not state.current_song and not state.queue: state.play_requested_at = time.monotonic()
 
-    if not state["voice_client"] or not state["voice_client"].is_connected():
+    if not state.voice_client or not state.voice_client.is_connected():
         if ctx.author.voice:
             await ctx.send("Joining your voice channel first...")
-            await join(ctx) # join will set state["voice_client"]
-            if not state["voice_client"] or not state["voice_client"].is_connected(): # Check again
+            await join(ctx) # join will set state.voice_client
+            if not state.voice_client or not state.voice_client.is_connected(): # Check again
+                state.play_requested_at = None
                 await ctx.send("Could not join your voice channel.")
                 return
         else:
+            state.play_requested_at = None
             await ctx.send("You're not in a VC, and I'm not in one. Join a VC first.")
             return
     
-    if ctx.author.voice and state["voice_client"].channel != ctx.author.voice.channel:
+    if ctx.author.voice and state.voice_client.channel != ctx.author.voice.channel:
         await ctx.send(f"Moving to your channel: **{ctx.author.voice.channel.name}**.")
-        await state["voice_client"].move_to(ctx.author.voice.channel)
-        state["last_channel_id"] = ctx.author.voice.channel.id
+        await state.voice_client.move_to(ctx.author.voice.channel)
+        state.last_channel_id = ctx.author.voice.channel.id
+
+    queries = split_queries(query)
+    if len(queries) > 1:
+        await enqueue_batch(ctx, queries)
+        await start_queue_if_idle(ctx)
+        return
+
+    if is_playlist_url(query.strip()):
+        if state.ingest_task and not state.ingest_task.done():
+            await ctx.send("Still loading the previous playlist. Use `!stop` to cancel it first.")
+            return
+        state.ingest_task = bot.loop.create_task(ingest_playlist(ctx, query.strip()))
+        return
 
     async with ctx.typing():
-        song_info = await search_youtube(query)
+        try:
+            song_info = await search_youtube(query)
+        except ExtractorBusy:
+            state.play_requested_at = None
+            await ctx.send("I'm handling too many song lookups right now. Try again in a moment.")
+            return
         if song_info is None:
+            state.play_requested_at = None
             await ctx.send(f"Could not find or process: `{query}`.")
             return
 
-        state["queue"].append(song_info)
-        await ctx.send(f"Added to queue: **{song_info['title']}**")
-        print(f"[{ctx.guild.id}] Added to queue: {song_info['title']}. Q len: {len(state['queue'])}. Playing: {state['is_playing']}")
+        state.enqueue(song_info)
+        if state.current_song and len(state.queue) == 1: schedule_prefetch(ctx.guild.id)
+        await ctx.send(f"Added to queue: **{song_info.title}**")
+        glog[ctx.guild.id].info("Added to queue: %s. Queue length: %d. Playing: %s", song_info.title, len(state.queue), state.is_playing)
+
+    await start_queue_if_idle(ctx)
+
+def split_queries(text):
+    return [q.strip() for q in text.replace('|', '\n').splitlines() if q.strip()]
+
+batch_lookup_slots = asyncio.Semaphore(GLOBAL_BATCH_LOOKUPS)
+
+async def enqueue_batch(ctx, queries):
+    # All lookups run at once (within the guild and global caps), so the wait is roughly the slowest one
+    state = get_guild_state(ctx.guild.id)
+    playlists = [q for q in queries if is_playlist_url(q)] # A full extraction of those would time out the worker
+    queries = [q for q in queries if not is_playlist_url(q)]
+    if len(queries) > MAX_BATCH_QUERIES:
+        await ctx.send(f"Only the first {MAX_BATCH_QUERIES} of {len(queries)} songs will be looked up.")
+        queries = queries[:MAX_BATCH_QUERIES]
+
+    async def lookup(q):
+        async with state.lookup_slots, batch_lookup_slots:
+            try: return await search_youtube(q)
+            except ExtractorBusy as e: return e
+
+    async with ctx.typing():
+        results = await asyncio.gather(*(lookup(q) for q in queries))
+    added = [r for r in results if isinstance(r, Track)]
+    failed = [q for q, r in zip(queries, results) if r is None]
+    busy = [q for q, r in zip(queries, results) if isinstance(r, ExtractorBusy)]
+    if added:
+        was_empty = not state.queue
+        state.enqueue_many(added) # In the order the user typed them, not the order lookups finished
+        if was_empty and state.current_song: schedule_prefetch(ctx.guild.id)
+    glog[ctx.guild.id].info("Batch enqueue: %d added, %d failed, %d busy, %d playlist(s) rejected. Queue length: %d",
+                            len(added), len(failed), len(busy), len(playlists), len(state.queue))
+
+    lines = [f"Added {len(added)} song(s) to queue:"] + [f"{i}. **{t.title}**" for i, t in enumerate(added, 1)]
+    if failed: lines.append("Could not find: " + ", ".join(f"`{q}`" for q in failed))
+    if busy: lines.append("I'm handling too many song lookups right now; try these again in a moment: " + ", ".join(f"`{q}`" for q in busy))
+    if playlists: lines.append("Playlists can't be mixed with other songs; play each one on its own: " + ", ".join(f"`{q}`" for q in playlists))
+    summary = "\n".join(lines)
+    await ctx.send(summary if len(summary) <= 2000 else summary[:1997] + "...")
+
+async def start_queue_if_idle(ctx):
+    state = get_guild_state(ctx.guild.id)
+    async with state.lock: # Two !play commands finishing together must not both start the queue
+        if state.queue: stop_silence(state) # Hand stay-mode silence over to the queue immediately
+        vc = state.voice_client
+        if vc and vc.is_connected() and not state.is_playing:
+            if not vc.is_playing() and not vc.is_paused():
+                glog[ctx.guild.id].debug("Not currently playing anything, starting queue.")
+                await start_next_song(ctx.guild.id) # This will pop from queue and play
+            elif vc.is_paused():
+                 await ctx.send(f"I'm paused. Use `!resume` or `!skip` for this new song.")
+        elif not (vc and vc.is_connected()):
+            glog[ctx.guild.id].info("Voice client disconnected before the queue could start.")
 
-    vc = state["voice_client"]
-    if vc and vc.is_connected() and not state["is_playing"]:
-        if not vc.is_playing() and not vc.is_paused(): 
-            print(f"[{ctx.guild.id}] Play cmd: Not currently playing anything, starting queue via song_finished_callback.")
-            await song_finished_callback(None, ctx.guild.id) # This will pop from queue and play
-        elif vc.is_paused():
-             await ctx.send(f"I'm paused. Use `!resume` or `!skip` for this new song.")
-    elif not (vc and vc.is_connected()):
-        print(f"[{ctx.guild.id}] Play cmd: VC became disconnected before trying to play.")
+async def ingest_playlist(ctx, url):
+    # Lists the playlist (first page, then the rest) and queues placeholders; streams are resolved only when a track comes up
+    state = get_guild_state(ctx.guild.id)
+    progress = await ctx.send("Loading playlist...")
+    start, queued, playlist_title = 1, 0, "playlist"
+    try:
+        # yt-dlp re-reads a playlist's pages from the beginning on every call, so fetching it in many small
+        # chunks costs quadratically many page loads; one call for the first page and one for the rest is linear
+        for end in (min(PLAYLIST_FIRST_CHUNK, MAX_PLAYLIST_TRACKS), MAX_PLAYLIST_TRACKS):
+            if start > end: break
+            info = await ytdl_pool.extract(url, playlist_items=f"{start}-{end}", timeout=PLAYLIST_TIMEOUT if start > 1 else None, **YTDL_PLAYLIST_OVERRIDES)
+            entries = (info or {}).get('entries') or []
+            playlist_title = (info or {}).get('title') or playlist_title
+            tracks = [Track.placeholder(e) for e in entries if e.get('id')]
+            if tracks:
+                was_empty = not state.queue
+                state.enqueue_many(tracks)
+                queued += len(tracks)
+                mark_snapshot(ctx.guild.id)
+                if was_empty and state.current_song: schedule_prefetch(ctx.guild.id)
+                if start == 1: await start_queue_if_idle(ctx)
+            if len(entries) < end - start + 1: break
+            await progress.edit(content=f"Loading **{playlist_title}**... {queued} track(s) queued so far, fetching the rest.")
+            start = end + 1
+    except ExtractorBusy:
+        await progress.edit(content=f"I'm handling too many song lookups right now. Queued {queued} track(s) from **{playlist_title}** before stopping.")
+        return
+    except asyncio.CancelledError:
+        await progress.edit(content=f"Stopped loading **{playlist_title}** after {queued} track(s).")
+        raise
+    except Exception as e:
+        glog[ctx.guild.id].exception("Error loading playlist %s", url)
+        await progress.edit(content=f"Error loading playlist after {queued} track(s): {e}")
+        return
+    if queued: await progress.edit(content=f"Queued {queued} track(s) from **{playlist_title}**.")
+    else: await progress.edit(content=f"Could not find any tracks in: `{url}`.")
 
 @bot.command(name='skip', aliases=['s'], help='Skips the current song.')
 async def skip(ctx):
     state = get_guild_state(ctx.guild.id)
-    state["last_ctx"] = ctx
-    if state["voice_client"] and (state["voice_client"].is_playing() or state["voice_client"].is_paused() or state["current_song"]):
+    state.last_ctx = ctx
+    if state.voice_client and not state.is_playing_silence and (state.voice_client.is_playing() or state.voice_client.is_paused() or state.current_song):
         await ctx.send("Skipping...")
-        state["voice_client"].stop() # This triggers song_finished_callback
+        state.voice_client.stop() # This triggers song_finished_callback
     else:
         await ctx.send("Not playing anything to skip.")
 
 @bot.command(name='stop', help='Stops the music and clears the queue.')
 async def stop(ctx):
     state = get_guild_state(ctx.guild.id)
-    state["last_ctx"] = ctx
-    if state["voice_client"] and state["voice_client"].is_connected():
-        state["queue"].clear()
-        state["current_song"] = None
-        state["is_playing_silence"] = False
-        state["is_playing"] = False
-        if state["voice_client"].is_playing() or state["voice_client"].is_paused():
-            state["voice_client"].stop()
-        await ctx.send("Music stopped and queue cleared.")
-    else:
-        await ctx.send("Not in a voice channel or not playing anything.")
+    state.last_ctx = ctx
+    async with state.lock:
+        if state.voice_client and state.voice_client.is_connected():
+            state.queue.clear()
+            cancel_ingest(state)
+            discard_prefetch(state)
+            state.current_song = None
+            state.current_source = None
+            state.is_playing = False
+            if not state.is_playing_silence and (state.voice_client.is_playing() or state.voice_client.is_paused()):
+                state.voice_client.stop()
+            await play_silent_audio_if_needed(ctx.guild.id) # Stay mode keeps the connection alive
+            await ctx.send("Music stopped and queue cleared.")
+        else:
+            await ctx.send("Not in a voice channel or not playing anything.")
 
 @bot.command(name='pause', help='Pauses the current song.')
 async def pause(ctx):
     state = get_guild_state(ctx.guild.id)
-    state["last_ctx"] = ctx
-    if state["voice_client"] and state["voice_client"].is_playing(): # Only pause if actively playing
-        state["voice_client"].pause()
-        state["is_playing"] = False # No longer actively outputting sound
-        await ctx.send("Paused music.")
-    else:
-        await ctx.send("Not playing anything to pause.")
+    state.last_ctx = ctx
+    async with state.lock:
+        if state.voice_client and state.voice_client.is_playing() and not state.is_playing_silence: # Only pause if actively playing
+            state.voice_client.pause()
+            state.is_playing = False # No longer actively outputting sound
+            await ctx.send("Paused music.")
+        else:
+            await ctx.send("Not playing anything to pause.")
 
 @bot.command(name='resume', help='Resumes the paused song.')
 async def resume(ctx):
     state = get_guild_state(ctx.guild.id)
-    state["last_ctx"] = ctx
-    if state["voice_client"] and state["voice_client"].is_paused():
-        state["voice_client"].resume()
-        state["is_playing"] = True # Actively outputting sound again
-        await ctx.send("Resumed music.")
-    elif state["voice_client"] and not state["voice_client"].is_playing() and state["current_song"] and not state["is_playing"]:
-        # If we have a current_song but bot thinks it's not playing (e.g. after pause then stop, or an error)
-        await ctx.send("Attempting to restart current song...")
-        await play_song_in_vc(ctx.guild.id, state["current_song"])
-    elif state["voice_client"] and not state["voice_client"].is_playing() and state["queue"] and not state["is_playing"]:
-        # If queue has songs but nothing is playing
-        await ctx.send("Queue has songs, attempting to play next...")
-        await song_finished_callback(None, ctx.guild.id)
-    else:
-        await ctx.send("Music is not paused or nothing to resume.")
+    state.last_ctx = ctx
+    async with state.lock:
+        if state.voice_client and state.voice_client.is_paused():
+            state.voice_client.resume()
+            state.is_playing = True # Actively outputting sound again
+            await ctx.send("Resumed music.")
+        elif state.voice_client and not state.voice_client.is_playing() and state.current_song and not state.is_playing:
+            # If we have a current_song but bot thinks it's not playing (e.g. after pause then stop, or an error)
+            position = state.position
+            await ctx.send(f"Attempting to resume current song from {format_duration(position)}...")
+            await play_song_in_vc(ctx.guild.id, state.current_song, start=position, announce=False)
+        elif state.voice_client and not state.voice_client.is_playing() and state.queue and not state.is_playing:
+            # If queue has songs but nothing is playing
+            await ctx.send("Queue has songs, attempting to play next...")
+            await start_next_song(ctx.guild.id)
+        else:
+            await ctx.send("Music is not paused or nothing to resume.")
 
-@bot.command(name='queue', aliases=['q'], help='Shows the current music queue.')
-async def queue(ctx):
+@bot.command(name='seek', help='Jumps to a position in the current song. Usage: !seek <1:30 | 90>')
+async def seek(ctx, position: str):
     state = get_guild_state(ctx.guild.id)
-    state["last_ctx"] = ctx
-    print(f"DEBUG [!q]: Guild ID: {ctx.guild.id}")
-    print(f"DEBUG [!q]: Current Song: {state.get('current_song')}")
-    print(f"DEBUG [!q]: Queue Contents: {state.get('queue')}")
-    print(f"DEBUG [!q]: Is Playing Silence: {state.get('is_playing_silence')}")
-    print(f"DEBUG [!q]: Is Playing (general): {state.get('is_playing')}")
-    
+    state.last_ctx = ctx
+    target = parse_timestamp(position)
+    if target is None:
+        await ctx.send("Use a position like `1:30` or `90`.")
+        return
+    async with state.lock:
+        song, vc = state.current_song, state.voice_client
+        if not song or not vc or not vc.is_connected():
+            await ctx.send("Not playing anything to seek in.")
+            return
+        if song.duration and target >= song.duration:
+            await ctx.send(f"**{song.title}** is only {format_duration(song.duration)} long.")
+            return
+        state.current_source = None # Makes the old source's after-callback stale so the queue doesn't advance
+        vc.stop()
+        await play_song_in_vc(ctx.guild.id, song, start=target, announce=False)
+    await ctx.send(f"Seeked to {format_duration(target)}.")
+
+@bot.command(name='nowplaying', aliases=['np'], help='Shows the current song and its progress.')
+async def nowplaying(ctx):
+    state = get_guild_state(ctx.guild.id)
+    state.last_ctx = ctx
+    song = state.current_song
+    if not song:
+        await ctx.send("Nothing is currently playing.")
+        return
+    embed = discord.Embed(title="💿 Now Playing", description=f"**{song.title}**", color=discord.Color.blue())
+    status = " (Paused)" if state.voice_client and state.voice_client.is_paused() else ""
+    embed.add_field(name="Progress" + status, value=progress_bar(state.position, song.duration), inline=False)
+    await ctx.send(embed=embed)
+
+@bot.command(name='queue', aliases=['q'], help='Shows the current music queue. Usage: !queue [page]')
+async def queue(ctx, page: int = 1):
+    state = get_guild_state(ctx.guild.id)
+    state.last_ctx = ctx
+    glog[ctx.guild.id].debug("!queue: current=%r, %d queued, playing=%s, silence=%s",
+                             state.current_song, len(state.queue), state.is_playing, state.is_playing_silence)
+
+    if not state.queue and not state.current_song and not state.is_playing_silence:
+        await ctx.send("The queue is empty and nothing is currently playing.")
+        return
+
     embed = discord.Embed(title="Music Queue", color=discord.Color.blue())
     now_playing_value = "Nothing specific is currently playing."
-    if state["current_song"]:
-        now_playing_value = f"**{state['current_song']['title']}**"
-        if state["voice_client"] and state["voice_client"].is_paused():
+    if state.current_song:
+        now_playing_value = f"**{state.current_song.title}**"
+        if state.voice_client and state.voice_client.is_paused():
             now_playing_value += " (Paused)"
-    elif state["is_playing_silence"]:
+    elif state.is_playing_silence:
          now_playing_value = "Playing silence to stay connected..."
     embed.add_field(name="💿 Now Playing", value=now_playing_value, inline=False)
 
-    if state["queue"]:
-        song_list = ""
-        for i, song in enumerate(state["queue"][:10]): song_list += f"{i+1}. {song['title']}\n"
-        embed.add_field(name="🎶 Up Next", value=song_list if song_list else "Queue is empty.", inline=False)
-        if len(state["queue"]) > 10: embed.set_footer(text=f"...and {len(state['queue']) - 10} more song(s).")
+    if state.queue:
+        page, page_count, entries = state.page(page, QUEUE_PAGE_SIZE)
+        song_list = "\n".join(f"{pos}. {track.title[:90]}" for pos, track in entries) # Titles capped to fit the 1024-char field limit
+        embed.add_field(name="🎶 Up Next", value=song_list, inline=False)
+        embed.set_footer(text=f"Page {page}/{page_count} · {len(state.queue)} song(s) in queue")
     else:
         embed.add_field(name="🎶 Up Next", value="Queue is empty.", inline=False)
-        
-    if not state["queue"] and not state["current_song"] and not state["is_playing_silence"]:
-        await ctx.send("The queue is empty and nothing is currently playing.")
-    else:
-        await ctx.send(embed=embed)
+    await ctx.send(embed=embed)
+
+@bot.command(name='remove', aliases=['rm'], help='Removes a song from the queue. Usage: !remove <position>')
+async def remove(ctx, position: int):
+    state = get_guild_state(ctx.guild.id)
+    state.last_ctx = ctx
+    async with state.lock:
+        if not 1 <= position <= len(state.queue):
+            await ctx.send(f"Position must be between 1 and {len(state.queue)}." if state.queue else "The queue is empty.")
+            return
+        track = state.remove(position - 1)
+        if position == 1: schedule_prefetch(ctx.guild.id)
+    await ctx.send(f"Removed from queue: **{track.title}**")
+
+@bot.command(name='move', aliases=['mv'], help='Moves a song to another queue position. Usage: !move <from> <to>')
+async def move(ctx, src: int, dst: int):
+    state = get_guild_state(ctx.guild.id)
+    state.last_ctx = ctx
+    async with state.lock:
+        if not (1 <= src <= len(state.queue) and 1 <= dst <= len(state.queue)):
+            await ctx.send(f"Positions must be between 1 and {len(state.queue)}." if state.queue else "The queue is empty.")
+            return
+        track = state.move(src - 1, dst - 1)
+        if 1 in (src, dst): schedule_prefetch(ctx.guild.id)
+    await ctx.send(f"Moved **{track.title}** to position {dst}.")
+
+@bot.command(name='shuffle', help='Shuffles the queue.')
+async def shuffle(ctx):
+    state = get_guild_state(ctx.guild.id)
+    state.last_ctx = ctx
+    async with state.lock:
+        if len(state.queue) < 2:
+            await ctx.send("Not enough songs in the queue to shuffle.")
+            return
+        state.shuffle()
+        schedule_prefetch(ctx.guild.id)
+    await ctx.send(f"Shuffled {len(state.queue)} song(s).")
+
+def format_latency(histogram, **labels):
+    summary = histogram.summary(**labels)
+    if not summary['count']: return "no samples"
+    return f"p50 {summary['p50'] * 1000:.0f} ms · p95 {summary['p95'] * 1000:.0f} ms · n={summary['count']}"
+
+@bot.command(name='stats', help='Shows performance statistics (bot owner only).')
+@commands.is_owner()
+async def stats(ctx):
+    states = list(music_queues.values())
+    embed = discord.Embed(title="📊 Bot Stats", color=discord.Color.blue())
+    ffmpeg = count_child_processes('ffmpeg')
+    embed.add_field(name="Voice", inline=False, value=(
+        f"{sum(1 for s in states if s.voice_client and s.voice_client.is_connected())} connected · "
+        f"{sum(1 for s in states if s.current_song)} playing · {'?' if ffmpeg is None else ffmpeg} ffmpeg · "
+        f"{sum(len(s.queue) for s in states)} queued (longest {max((len(s.queue) for s in states), default=0)})"))
+    extract_lines = [f"{labels['kind']} ({labels['outcome']}): {format_latency(EXTRACT_SECONDS, **labels)}"
+                     for labels in sorted(EXTRACT_SECONDS.labelsets(), key=lambda l: (l['kind'], l['outcome']))]
+    embed.add_field(name="Extraction", value="\n".join(extract_lines) or "no samples", inline=False)
+    embed.add_field(name="!play → first audio", value=format_latency(FIRST_AUDIO_SECONDS), inline=False)
+    embed.add_field(name="Track transitions", value=format_latency(TRANSITION_GAP_SECONDS), inline=False)
+    embed.add_field(name="Event loop lag", inline=False,
+                    value=f"{format_latency(LOOP_LAG_SECONDS)} · last {loop_monitor.last_lag * 1000:.0f} ms · {loop_monitor.stalls} stall(s)")
+    resolution = resolution_cache.stats()
+    caches = f"Resolution: {resolution['hit_rate']:.0%} of {resolution['hits'] + resolution['misses'] + resolution['coalesced']}"
+    if audio_cache:
+        audio = audio_cache.stats()
+        caches += f" · Audio: {audio['hit_rate']:.0%}, {audio['files']} files, {audio['bytes'] / 1024**2:.0f} MB"
+    embed.add_field(name="Caches", value=caches, inline=False)
+    pool = ytdl_pool.stats()
+    embed.add_field(name="yt-dlp pool", inline=False,
+                    value=f"{pool['workers']}/{pool['size']} workers · {pool['pending']} pending · {pool['timeouts']} timeouts · {pool['restarts']} restarts")
+    reconnects = rejoin_scheduler.stats()
+    embed.add_field(name="Reconnects", inline=False,
+                    value=f"{reconnects['pending']} pending · {reconnects['successes']} ok · {reconnects['failures']} failed · {reconnects['given_up']} given up")
+    slow = sum(SLOW_COMMANDS.value(command=l['command']) for l in COMMAND_SECONDS.labelsets())
+    embed.set_footer(text=f"{slow} slow command(s) · /metrics {'on port ' + str(METRICS_PORT) if metrics_server else 'disabled'}")
+    await ctx.send(embed=embed)
 
 # --- Error Handling & Run ---
 @bot.event
 async def on_command_error(ctx, error):
-    if ctx.guild: get_guild_state(ctx.guild.id)["last_ctx"] = ctx # Store context
-    if isinstance(error, commands.CommandNotFound): print(f"Cmd not found by {ctx.author}: {ctx.message.content}")
+    if ctx.guild: get_guild_state(ctx.guild.id).last_ctx = ctx # Store context
+    if isinstance(error, commands.CommandNotFound): log.debug("Command not found from %s: %s", ctx.author, ctx.message.content)
     elif isinstance(error, commands.MissingRequiredArgument): await ctx.send(f"Missing arg: `{error.param.name}` for `!{ctx.command.name}`.")
+    elif isinstance(error, commands.BadArgument): await ctx.send(f"Invalid argument for `!{ctx.command.name}`: {error}")
     elif isinstance(error, commands.CommandInvokeError):
-        print(f"Error in cmd '{ctx.command}'. Invoker: {ctx.author}. Msg: '{ctx.message.content}'. Err: {error.original}")
-        traceback.print_exception(type(error.original), error.original, error.original.__traceback__)
+        log.error("Error in !%s from %s: %r", ctx.command, ctx.author, ctx.message.content, exc_info=error.original,
+                  extra={'guild': ctx.guild.id if ctx.guild else None})
         await ctx.send(f"Error in `!{ctx.command.name}`. Check logs.")
     elif isinstance(error, commands.CheckFailure): await ctx.send("No permission.")
     else:
-        print(f"Unhandled error {type(error)}: {error}")
-        traceback.print_exception(type(error), error, error.__traceback__)
+        log.error("Unhandled command error %s: %s", type(error).__name__, error, exc_info=error)
+
+# --- Startup ---
+# Only the real entry point calls this. The yt-dlp workers re-import this file as __mp_main__; they must not
+# start a second log listener, sweep the audio cache or open the snapshot store.
+def setup():
+    global audio_cache, snapshot_store
+    logs.configure(LOG_LEVEL, LOG_FORMAT, ytdl_level=YTDL_LOG_LEVEL, rate_limit=LOG_RATE_LIMIT, fields=LOG_FIELDS)
+    if AUDIO_CACHE_DIR:
+        audio_cache = AudioCache(AUDIO_CACHE_DIR, max_bytes=AUDIO_CACHE_MAX_MB * 1024**2, min_plays=AUDIO_CACHE_MIN_PLAYS, policy=AUDIO_CACHE_POLICY)
+    if SNAPSHOT_FILE:
+        # Each cluster worker writes its own file but reads them all: after a reshard a guild may come back on another worker
+        snapshot_store = SnapshotStore(
+            f"{SNAPSHOT_FILE}.worker-{CLUSTER_WORKER}" if CLUSTER_WORKER else SNAPSHOT_FILE, capture_snapshot,
+            read_paths=glob.glob(glob.escape(SNAPSHOT_FILE) + ".worker-*") if CLUSTER_WORKER else None,
+            interval=SNAPSHOT_SECONDS, max_age=SNAPSHOT_MAX_AGE_HOURS * 3600,
+            positions=snapshot_positions, position_interval=SNAPSHOT_POSITION_SECONDS)
 
 if __name__ == "__main__":
-    print("DEBUG: Main script start...")
+    setup()
     token_preview = "TOKEN_NOT_SET"
     if TOKEN: token_preview = f"{TOKEN[:5]}...{TOKEN[-5:]}" if len(TOKEN) > 10 else "TOKEN_TOO_SHORT"
-    print(f"DEBUG: Token preview: {token_preview}")
-    if TOKEN:
+    log.debug("Token preview: %s", token_preview)
+    if TOKEN and CLUSTER_PROCESSES > 1 and not SHARD_IDS:
+        import cluster
+        try: cluster.main(os.path.abspath(__file__), TOKEN, SHARD_COUNT, CLUSTER_PROCESSES, CLUSTER_HOST_INDEX, CLUSTER_HOSTS, CLUSTER_PORT, METRICS_HOST)
+        except KeyboardInterrupt: pass
+        except Exception:
+            log.critical("Cluster supervisor failed", exc_info=True)
+    elif TOKEN:
         try:
-            print("DEBUG: Attempting to run bot with token...")
-            bot.run(TOKEN)
+            log.info("Starting bot...")
+            bot.run(TOKEN, log_handler=None) # discord.py logs through the handler logs.configure() installed
         except discord.errors.LoginFailure:
-            print("CRITICAL ERROR: Login Failure! Check token & intents.")
-        except Exception as e:
-            print(f"CRITICAL ERROR during bot.run: {e}")
-            traceback.print_exc()
+            log.critical("Login failure! Check token & intents.")
+        except Exception:
+            log.critical("Error during bot.run", exc_info=True)
     else:
-        print("CRITICAL ERROR: DISCORD_TOKEN not found.")
-    print("DEBUG: bot.run() has exited or script finished.")
+        log.critical("DISCORD_TOKEN not found.")
+    if snapshot_store and snapshot_restored: # Not before on_ready, or we'd overwrite the snapshot we never restored
+        for guild_id in music_queues: mark_snapshot(guild_id) # Fresh positions; voice disconnects on close don't advance the queues
+        try: snapshot_store.flush()
+        except OSError as e: log.error("Could not write snapshot on exit: %s", e)
+    ytdl_pool.close()
+    log.info("Bot has exited.")
+    logs.shutdown()
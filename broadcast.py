@@ -0,0 +1,178 @@
+import logging
+import threading
+import time
+
+import discord
+
+from sources import FRAME_SECONDS, OPUS_SILENCE_FRAME
+
+log = logging.getLogger(__name__)
+
+# --- Shared Decode Fan-out ---
+# One ffmpeg per (track, start position) produces Opus packets into a ring buffer; every guild playing
+# that track reads it through its own BroadcastSource cursor. ffmpeg processes and bandwidth then grow
+# with the number of distinct tracks playing instead of the number of guilds listening.
+
+
+class BroadcastProducer:
+    def __init__(self, hub, key, factory, capacity, lead_frames, start=0.0):
+        self.hub = hub
+        self.key = key
+        self.start = start
+        self.factory = factory # factory(start_seconds) -> Opus AudioSource
+        self.capacity = capacity
+        self.lead_frames = lead_frames
+        self.frames = [None] * capacity
+        self.produced = 0 # Absolute index of the next frame to be written
+        self.done = False
+        self.listeners = 0
+        self.clock_start = None # Set by the first read; until then only `lead_frames` are buffered
+        self.cond = threading.Condition()
+        self.source = factory(start)
+        self.thread = threading.Thread(target=self._run, name=f"broadcast-{key}", daemon=True)
+        self.thread.start()
+
+    @property
+    def oldest(self):
+        return max(0, self.produced - self.capacity)
+
+    def _run(self):
+        try:
+            while True:
+                with self.cond:
+                    while not self.done:
+                        # Stay `lead_frames` ahead of real time so readers never starve but memory stays bounded
+                        elapsed = 0 if self.clock_start is None else int((time.monotonic() - self.clock_start) / FRAME_SECONDS)
+                        if self.produced < elapsed + self.lead_frames: break
+                        self.cond.wait(FRAME_SECONDS * 5)
+                    if self.done: return
+                packet = self.source.read()
+                with self.cond:
+                    if not packet:
+                        self.done = True
+                        self.cond.notify_all()
+                        return
+                    self.frames[self.produced % self.capacity] = packet
+                    self.produced += 1
+                    self.cond.notify_all()
+        except Exception:
+            log.exception("Error in broadcast producer %s", self.key)
+            with self.cond:
+                self.done = True
+                self.cond.notify_all()
+        finally:
+            self.source.cleanup()
+            self.hub._producer_finished(self)
+
+    def read(self, cursor, timeout=1.0):
+        """Returns the packet at `cursor`, b'' at the end of the track, or None if it has been overwritten."""
+        with self.cond:
+            if self.clock_start is None: self.clock_start = time.monotonic()
+            if cursor < self.oldest: return None
+            if cursor >= self.produced and not self.done:
+                self.cond.wait_for(lambda: cursor < self.produced or self.done, timeout)
+            if cursor < self.produced: return self.frames[cursor % self.capacity]
+            # A reader briefly ahead of its producer hears silence; it's this exact object, so callers can tell filler from audio
+            return b'' if self.done else OPUS_SILENCE_FRAME
+
+    def stop(self):
+        with self.cond:
+            self.done = True
+            self.cond.notify_all()
+
+class BroadcastSource(discord.AudioSource):
+    def __init__(self, hub, producer, start_frame=0):
+        self.hub = hub
+        self.producer = producer
+        self.cursor = start_frame
+        self.attached = True
+        self.fallback = None # Private ffmpeg used after falling too far behind (e.g. a long pause)
+
+    @property
+    def position(self):
+        """Seconds into the track of the next packet to be read."""
+        return self.producer.start + self.cursor * FRAME_SECONDS
+
+    def read(self):
+        if self.fallback is not None:
+            packet = self.fallback.read()
+        else:
+            packet = self.producer.read(self.cursor)
+            if packet is None:
+                log.info("Broadcast reader fell behind on %s, switching to a private stream.", self.producer.key)
+                self.fallback = self.producer.factory(self.position)
+                self.attached = False
+                self.hub._detach(self.producer)
+                self.hub.fallbacks += 1
+                packet = self.fallback.read()
+        if packet and packet is not OPUS_SILENCE_FRAME: self.cursor += 1 # Filler during a stall isn't a frame of the track
+        return packet
+
+    def is_opus(self):
+        return True
+
+    def alive(self):
+        if self.fallback is not None: return True
+        return self.attached and (not self.producer.done or self.cursor < self.producer.produced)
+
+    def cleanup(self):
+        # discord.py calls this when playback stops; it may also run again from our own code, so keep it idempotent
+        if self.attached:
+            self.attached = False
+            self.hub._detach(self.producer)
+        if self.fallback is not None:
+            self.fallback.cleanup()
+            self.fallback = None
+
+class BroadcastHub:
+    def __init__(self, buffer_seconds=30.0, lead_seconds=5.0, attach_window=10.0):
+        self.capacity = int(buffer_seconds / FRAME_SECONDS)
+        self.lead_frames = int(lead_seconds / FRAME_SECONDS)
+        self.attach_window = attach_window # Late joiners within this many seconds start from frame 0 of a running producer
+        self._producers = {} # (key, start seconds) -> [BroadcastProducer]
+        self._lock = threading.Lock()
+        self.attaches = 0
+        self.spawns = 0
+        self.fallbacks = 0
+
+    def open(self, key, factory, start=0.0):
+        key = (key, round(start, 2))
+        with self._lock:
+            for producer in self._producers.get(key, ()):
+                if producer.done or producer.oldest > 0: continue
+                played = 0.0 if producer.clock_start is None else time.monotonic() - producer.clock_start
+                if played <= self.attach_window:
+                    producer.listeners += 1
+                    self.attaches += 1
+                    return BroadcastSource(self, producer)
+        producer = BroadcastProducer(self, key, factory, self.capacity, self.lead_frames, start) # Spawns ffmpeg; outside the lock
+        producer.listeners = 1
+        with self._lock:
+            self._producers.setdefault(key, []).append(producer)
+            self.spawns += 1
+        return BroadcastSource(self, producer)
+
+    def _detach(self, producer):
+        with self._lock:
+            producer.listeners -= 1
+            if producer.listeners > 0: return
+            self._remove(producer)
+        producer.stop() # Nobody is listening any more; the producer thread kills ffmpeg on its way out
+
+    def _producer_finished(self, producer):
+        with self._lock:
+            if producer.listeners <= 0: self._remove(producer)
+
+    def _remove(self, producer):
+        producers = self._producers.get(producer.key)
+        if producers and producer in producers:
+            producers.remove(producer)
+            if not producers: del self._producers[producer.key]
+
+    def stats(self):
+        with self._lock:
+            producers = [p for ps in self._producers.values() for p in ps]
+            return {
+                "producers": len(producers), "listeners": sum(p.listeners for p in producers),
+                "spawns": self.spawns, "attaches": self.attaches, "fallbacks": self.fallbacks,
+            }
@@ -0,0 +1,234 @@
+import asyncio
+import logging
+import os
+import random
+import signal
+import sys
+import time
+
+import aiohttp
+from aiohttp import web
+
+log = logging.getLogger(__name__)
+
+# --- Cluster Supervisor ---
+# Runs one bot process per core, each an AutoShardedBot over a contiguous range of shards. Discord routes
+# a guild's events to the shard that owns it, so per-guild state never has to leave its process.
+# The supervisor starts workers one at a time (shards must IDENTIFY a few seconds apart), restarts any that
+# crash or stop answering, and serves their combined /metrics and /health.
+
+GATEWAY_BOT_URL = "https://discord.com/api/v10/gateway/bot"
+
+def shard_ranges(shard_count, processes):
+    """Splits shard ids 0..shard_count-1 into `processes` contiguous, near-equal ranges."""
+    return [list(range(i * shard_count // processes, (i + 1) * shard_count // processes)) for i in range(processes)]
+
+async def recommended_shard_count(token):
+    async with aiohttp.ClientSession() as session:
+        async with session.get(GATEWAY_BOT_URL, headers={"Authorization": f"Bot {token}"}) as response:
+            response.raise_for_status()
+            return (await response.json())["shards"]
+
+def relabel(text, label, value, families):
+    """Adds label="value" to every sample in Prometheus `text`, grouping samples into `families` by metric name."""
+    current = None
+    for line in text.splitlines():
+        if not line: continue
+        if line.startswith('#'):
+            parts = line.split(None, 3)
+            if len(parts) >= 3 and parts[1] in ('HELP', 'TYPE'):
+                current = families.setdefault(parts[2], ([], []))
+                if line not in current[0]: current[0].append(line)
+            continue
+        if current is None: continue
+        name_end = min((i for i in (line.find('{'), line.find(' ')) if i >= 0), default=len(line))
+        if line[name_end:name_end + 1] == '{': sample = f'{line[:name_end]}{{{label}="{value}",{line[name_end + 1:]}'
+        else: sample = f'{line[:name_end]}{{{label}="{value}"}}{line[name_end:]}'
+        current[1].append(sample.replace(',}', '}'))
+
+class Worker:
+    def __init__(self, index, shard_ids, port):
+        self.index = index # Cluster-wide, so ids stay unique across hosts
+        self.shard_ids = shard_ids
+        self.port = port # Local /metrics + /health of this worker
+        self.process = None
+        self.started_at = None
+        self.restarts = 0
+        self.ready = False
+        self.failed_checks = 0
+        self.health = None
+
+    @property
+    def alive(self):
+        return self.process is not None and self.process.returncode is None
+
+class Supervisor:
+    def __init__(self, script, shard_count, processes, host_index=0, host_count=1, port=9108, host='127.0.0.1',
+                 health_interval=10.0, unhealthy_checks=6, ready_timeout=None):
+        self.script = script
+        self.shard_count = shard_count
+        self.processes = processes # On this host
+        self.host_index = host_index
+        self.host_count = host_count
+        self.port = port
+        self.host = host
+        self.health_interval = health_interval
+        self.unhealthy_checks = unhealthy_checks # Consecutive failed health checks before a worker is killed
+        self.ready_timeout = ready_timeout
+        self.workers = []
+        self._stopping = asyncio.Event()
+        self._session = None
+
+    def worker_env(self, worker):
+        env = dict(os.environ)
+        env.update({
+            'SHARD_COUNT': str(self.shard_count), 'SHARD_IDS': ",".join(map(str, worker.shard_ids)),
+            'CLUSTER_WORKER': str(worker.index), 'METRICS_PORT': str(worker.port), 'METRICS_HOST': '127.0.0.1',
+        })
+        env.pop('CLUSTER_PROCESSES', None) # Workers must not start clusters of their own
+        cpus = os.cpu_count() or 1
+        env.setdefault('YTDL_WORKERS', str(max(1, min(4, cpus // self.processes)))) # Don't oversubscribe cores across workers
+        if env.get('AUDIO_CACHE_DIR'):
+            # The cache's in-memory index assumes it is the only writer, so each worker gets its own share
+            env['AUDIO_CACHE_DIR'] = os.path.join(env['AUDIO_CACHE_DIR'], f"worker-{worker.index}")
+            env['AUDIO_CACHE_MAX_MB'] = str(int(env.get('AUDIO_CACHE_MAX_MB', '2048')) // self.processes)
+        return env
+
+    async def _spawn(self, worker):
+        worker.process = await asyncio.create_subprocess_exec(sys.executable, self.script, env=self.worker_env(worker))
+        worker.started_at = time.monotonic()
+        worker.ready = False
+        worker.failed_checks = 0
+        log.info("Started worker %d (pid %d) for shards %d-%d.", worker.index, worker.process.pid, worker.shard_ids[0], worker.shard_ids[-1])
+
+    async def _check(self, worker):
+        try:
+            async with self._session.get(f"http://127.0.0.1:{worker.port}/health", timeout=aiohttp.ClientTimeout(total=5)) as response:
+                worker.health = await response.json()
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError):
+            worker.health = None
+        return bool(worker.health and worker.health.get('ready'))
+
+    async def _wait_ready(self, worker):
+        # Shards identify about 5 s apart; starting the next worker only after this one is ready keeps us under the limit
+        deadline = time.monotonic() + (self.ready_timeout or 60 + 6 * len(worker.shard_ids))
+        while worker.alive and time.monotonic() < deadline and not self._stopping.is_set():
+            if await self._check(worker):
+                worker.ready = True
+                return True
+            await asyncio.sleep(1)
+        return False
+
+    async def _supervise(self, worker, first_start):
+        delay = 1.0
+        await first_start
+        while not self._stopping.is_set():
+            await worker.process.wait()
+            if self._stopping.is_set(): return
+            uptime = time.monotonic() - worker.started_at
+            if uptime > 300: delay = 1.0 # Ran fine for a while; this is a fresh failure, not a crash loop
+            log.warning("Worker %d exited with code %s after %.0fs; restarting in ~%.0fs.", worker.index, worker.process.returncode, uptime, delay)
+            await asyncio.sleep(random.uniform(0.5, 1.5) * delay)
+            delay = min(60.0, delay * 2)
+            if self._stopping.is_set(): return
+            worker.restarts += 1
+            await self._spawn(worker)
+            await self._wait_ready(worker)
+
+    async def _health_loop(self):
+        while not self._stopping.is_set():
+            await asyncio.sleep(self.health_interval)
+            for worker in self.workers:
+                if not worker.alive or not worker.ready: continue # Starting up, or already being restarted
+                if await self._check(worker):
+                    worker.failed_checks = 0
+                    continue
+                worker.failed_checks += 1
+                if worker.failed_checks >= self.unhealthy_checks:
+                    log.error("Worker %d failed %d health checks in a row; killing it.", worker.index, worker.failed_checks)
+                    worker.process.kill() # _supervise sees the exit and restarts it
+
+    # --- Aggregated endpoints ---
+
+    async def handle_metrics(self, request):
+        async def fetch(worker):
+            if not worker.alive: return worker, None
+            try:
+                async with self._session.get(f"http://127.0.0.1:{worker.port}/metrics", timeout=aiohttp.ClientTimeout(total=5)) as response:
+                    return worker, await response.text()
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                return worker, None
+        families = {}
+        for worker, text in await asyncio.gather(*(fetch(w) for w in self.workers)):
+            if text: relabel(text, 'worker', worker.index, families)
+        lines = []
+        for header, samples in families.values(): lines += header + samples
+        lines += ["# HELP musicbot_cluster_worker_up Whether the worker process is running and ready.",
+                  "# TYPE musicbot_cluster_worker_up gauge"]
+        lines += [f'musicbot_cluster_worker_up{{worker="{w.index}"}} {int(w.alive and w.ready)}' for w in self.workers]
+        lines += ["# HELP musicbot_cluster_worker_restarts_total Times the supervisor restarted the worker.",
+                  "# TYPE musicbot_cluster_worker_restarts_total counter"]
+        lines += [f'musicbot_cluster_worker_restarts_total{{worker="{w.index}"}} {w.restarts}' for w in self.workers]
+        return web.Response(body=("\n".join(lines) + "\n").encode(), headers={'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'})
+
+    async def handle_health(self, request):
+        workers = [{
+            "worker": w.index, "pid": w.process.pid if w.process else None, "alive": w.alive, "ready": w.ready,
+            "shards": [w.shard_ids[0], w.shard_ids[-1]], "restarts": w.restarts,
+            "uptime_s": round(time.monotonic() - w.started_at) if w.alive else None, "health": w.health,
+        } for w in self.workers]
+        healthy = all(w["alive"] and w["ready"] for w in workers)
+        return web.json_response({"healthy": healthy, "shard_count": self.shard_count, "workers": workers}, status=200 if healthy else 503)
+
+    # --- Lifecycle ---
+
+    async def run(self):
+        total = self.processes * self.host_count
+        ranges = shard_ranges(self.shard_count, total)
+        first = self.host_index * self.processes
+        self.workers = [Worker(first + i, ranges[first + i], self.port + 1 + i) for i in range(self.processes) if ranges[first + i]]
+        log.info("Cluster host %d/%d: %d worker(s) over shards %d-%d of %d.", self.host_index + 1, self.host_count,
+                 len(self.workers), self.workers[0].shard_ids[0], self.workers[-1].shard_ids[-1], self.shard_count)
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            try: loop.add_signal_handler(sig, self._stopping.set)
+            except NotImplementedError: pass # Windows; Ctrl+C still raises KeyboardInterrupt
+        self._session = aiohttp.ClientSession()
+        app = web.Application()
+        app.router.add_get('/metrics', self.handle_metrics)
+        app.router.add_get('/health', self.handle_health)
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        await web.TCPSite(runner, self.host, self.port).start()
+        log.info("Cluster /metrics and /health on http://%s:%d", self.host, self.port)
+        tasks = [loop.create_task(self._health_loop())]
+        try:
+            for worker in self.workers: # One at a time, so shards identify in order
+                started = loop.create_future()
+                tasks.append(loop.create_task(self._supervise(worker, started)))
+                await self._spawn(worker)
+                started.set_result(None)
+                if not await self._wait_ready(worker) and not self._stopping.is_set():
+                    log.warning("Worker %d not ready in time; starting the next one anyway.", worker.index)
+            await self._stopping.wait()
+        finally:
+            log.info("Stopping cluster...")
+            for task in tasks: task.cancel()
+            for worker in self.workers:
+                if worker.alive: worker.process.terminate()
+            for worker in self.workers:
+                if not worker.process: continue
+                try: await asyncio.wait_for(worker.process.wait(), timeout=15)
+                except asyncio.TimeoutError: worker.process.kill()
+            await self._session.close()
+            await runner.cleanup()
+
+def main(script, token, shard_count, processes, host_index=0, host_count=1, port=9108, host='127.0.0.1'):
+    async def start():
+        count = shard_count
+        if not count:
+            if host_count > 1: raise SystemExit("SHARD_COUNT must be set when the cluster spans several hosts.")
+            count = await recommended_shard_count(token)
+            log.info("Discord recommends %d shard(s).", count)
+        await Supervisor(script, max(count, processes * host_count), processes, host_index, host_count, port, host).run()
+    asyncio.run(start())
@@ -0,0 +1,129 @@
+import asyncio
+import random
+from collections import deque
+from itertools import islice
+
+# --- Per-guild Player State ---
+
+class Track:
+    __slots__ = ('id', 'title', 'source', 'page_url', 'duration', 'acodec', 'abr')
+
+    # source is the direct stream URL; playlist placeholders leave it None until just before they play
+    def __init__(self, title, source, id=None, page_url=None, duration=None, acodec=None, abr=None):
+        self.id = id
+        self.title = title
+        self.source = source
+        self.page_url = page_url
+        self.duration = duration
+        self.acodec = acodec
+        self.abr = abr
+
+    @classmethod
+    def from_info(cls, info):
+        return cls(info['title'], info['source'], id=info.get('id'), page_url=info.get('page_url'),
+                   duration=info.get('duration'), acodec=info.get('acodec'), abr=info.get('abr'))
+
+    @classmethod
+    def placeholder(cls, entry):
+        """Builds an unresolved Track from a flat playlist entry (id, title, page URL only)."""
+        return cls(entry.get('title') or entry['id'], None, id=entry['id'],
+                   page_url=entry.get('url') or entry.get('webpage_url'), duration=entry.get('duration'))
+
+    def snapshot(self):
+        """Compact dict for persisting the queue. The stream URL is left out: it expires and is tied to our IP."""
+        return {k: v for k in ('id', 'title', 'page_url', 'duration') if (v := getattr(self, k)) is not None}
+
+    @classmethod
+    def from_snapshot(cls, data):
+        return cls(data.get('title') or data.get('id'), None, id=data.get('id'), page_url=data.get('page_url'), duration=data.get('duration'))
+
+    @property
+    def resolved(self):
+        return self.source is not None
+
+    @property
+    def lookup_url(self):
+        if self.page_url: return self.page_url
+        return f"https://www.youtube.com/watch?v={self.id}" if self.id else None
+
+    def update(self, other):
+        """Takes fresh fields from a re-resolved Track while keeping this object (and its queue position)."""
+        for name in self.__slots__:
+            value = getattr(other, name)
+            if value is not None: setattr(self, name, value)
+
+    def __repr__(self):
+        return f"Track(id={self.id!r}, title={self.title!r})"
+
+class GuildPlayer:
+    __slots__ = (
+        'guild_id', 'queue', 'voice_client', 'current_song', 'current_source', 'is_playing',
+        'loop_song', 'loop_queue', 'keep_alive_active', 'is_playing_silence', 'silence_source',
+        'last_channel_id', 'last_ctx', 'prefetch_task', 'prefetched',
+        'last_transition_ms', 'ingest_task', 'lock', 'lookup_slots', 'play_requested_at', 'transition_started_at',
+        'resume_position', 'text_channel_id',
+    )
+
+    def __init__(self, guild_id, lookup_concurrency=3):
+        self.guild_id = guild_id
+        self.queue = deque()
+        self.voice_client = None
+        self.current_song = None
+        self.current_source = None # PositionTrackingSource for current_song; kept after a disconnect so playback can resume
+        self.is_playing = False
+        self.loop_song = False
+        self.loop_queue = False
+        self.keep_alive_active = False
+        self.is_playing_silence = False
+        self.silence_source = None # SilenceSource currently held by the voice client in stay mode
+        self.last_channel_id = None
+        self.last_ctx = None
+        self.prefetch_task = None
+        self.prefetched = None # (Track, AudioSource) warmed up for the head of the queue
+        self.last_transition_ms = None
+        self.ingest_task = None # Background playlist ingestion, cancelled by !stop / !leave
+        self.lock = asyncio.Lock() # Held by anything that changes current_song / is_playing / the queue head
+        self.lookup_slots = asyncio.Semaphore(lookup_concurrency) # One guild's batch can't take every extraction worker
+        self.play_requested_at = None # time.monotonic() of a !play issued while idle, until its first audio frame
+        self.transition_started_at = None # When the previous track stopped, until the next one's first audio frame
+        self.resume_position = 0.0 # Where to pick current_song up when it has no source yet (restored after a restart)
+        self.text_channel_id = None # Where the last command came from; saved with snapshots so announcements survive restarts
+
+    @property
+    def position(self):
+        """Seconds played of current_song."""
+        return self.current_source.position if self.current_source else self.resume_position
+
+    # Queue positions below are 0-based; commands translate from the 1-based numbers users see.
+
+    def enqueue(self, track):
+        self.queue.append(track)
+
+    def enqueue_many(self, tracks):
+        self.queue.extend(tracks)
+
+    def pop_next(self):
+        return self.queue.popleft() if self.queue else None
+
+    def remove(self, index):
+        track = self.queue[index]
+        del self.queue[index]
+        return track
+
+    def move(self, src, dst):
+        track = self.remove(src)
+        self.queue.insert(dst, track)
+        return track
+
+    def shuffle(self):
+        tracks = list(self.queue)
+        random.shuffle(tracks)
+        self.queue.clear()
+        self.queue.extend(tracks)
+
+    def page(self, page, per_page=10):
+        """Returns (page_number, page_count, [(position, track), ...]) with 1-based positions."""
+        page_count = max(1, -(-len(self.queue) // per_page))
+        page = min(max(1, page), page_count)
+        start = (page - 1) * per_page
+        return page, page_count, list(enumerate(islice(self.queue, start, start + per_page), start + 1))
@@ -0,0 +1,155 @@
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import sys
+import threading
+import time
+
+# --- Logging ---
+# Records are formatted and written by a background thread, so a slow stdout (e.g. a hosted log drain)
+# never blocks the event loop. Callers only pay for the level check, the filters and a non-blocking put.
+
+_STANDARD_ATTRS = set(vars(logging.makeLogRecord({}))) | {'message', 'asctime'}
+
+class GuildAdapter(logging.LoggerAdapter):
+    """Adds a `guild` field to every record."""
+
+    def process(self, msg, kwargs):
+        kwargs['extra'] = {**self.extra, **kwargs.get('extra', {})}
+        return msg, kwargs
+
+class GuildLoggers(dict):
+    """guild_id -> GuildAdapter, created on first use: `glog[guild_id].info(...)`."""
+
+    def __init__(self, logger):
+        super().__init__()
+        self.logger = logger
+
+    def __missing__(self, guild_id):
+        adapter = self[guild_id] = GuildAdapter(self.logger, {'guild': guild_id})
+        return adapter
+
+class RateLimitFilter(logging.Filter):
+    """Lets through at most `burst` records per message template every `period` seconds.
+
+    WARNING and above always pass. A record can also carry `extra={'sample': 0.01}` to be kept
+    with that probability. The first record after a suppressed run reports how many were dropped.
+    """
+
+    def __init__(self, burst=20, period=60.0, exempt_level=logging.WARNING):
+        super().__init__()
+        self.burst = burst
+        self.period = period
+        self.exempt_level = exempt_level
+        self._windows = {} # (logger, template) -> [window start, passed, suppressed]
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if record.levelno >= self.exempt_level: return True
+        sample = getattr(record, 'sample', None)
+        if sample is not None and random.random() >= sample: return False
+        if not self.burst: return True
+        key = (record.name, record.msg)
+        now = time.monotonic()
+        with self._lock:
+            window = self._windows.get(key)
+            if window is None or now - window[0] >= self.period:
+                suppressed = window[2] if window else 0
+                if len(self._windows) > 10000: self._windows.clear() # Templates are a bounded set; this only guards against misuse
+                self._windows[key] = [now, 1, 0]
+                if suppressed: record.suppressed = suppressed
+                return True
+            if window[1] < self.burst:
+                window[1] += 1
+                return True
+            window[2] += 1
+            return False
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """Drops (and counts) records instead of blocking when the writer thread falls behind."""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record):
+        try: self.queue.put_nowait(record)
+        except queue.Full: self.dropped += 1
+
+    def prepare(self, record):
+        # The listener thread formats the record; QueueHandler.prepare() would format it here, on the event loop,
+        # and drop exc_info, so the JSON formatter would never see the exception
+        return record
+
+class StaticFields(logging.Filter):
+    """Sets the same attributes on every record, e.g. which cluster worker wrote it."""
+
+    def __init__(self, fields):
+        super().__init__()
+        self.fields = fields
+
+    def filter(self, record):
+        for key, value in self.fields.items(): setattr(record, key, value)
+        return True
+
+class TextFormatter(logging.Formatter):
+    def __init__(self, prefix=""):
+        super().__init__(f"%(asctime)s {prefix}%(levelname)-7s %(name)s:%(guild_tag)s %(message)s")
+
+    def format(self, record):
+        guild = getattr(record, 'guild', None)
+        record.guild_tag = f" [{guild}]" if guild is not None else ""
+        text = super().format(record)
+        suppressed = getattr(record, 'suppressed', None)
+        return f"{text} ({suppressed} similar suppressed)" if suppressed else text
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "ts": self.formatTime(record, "%Y-%m-%dT%H:%M:%S") + f".{int(record.msecs):03d}",
+            "level": record.levelname, "logger": record.name, "msg": record.getMessage(),
+        }
+        entry.update((k, v) for k, v in vars(record).items() if k not in _STANDARD_ATTRS)
+        if record.exc_info: entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+_listener = None
+_queue_handler = None
+
+def configure(level="INFO", fmt="text", ytdl_level="WARNING", rate_limit=20, queue_size=10000, background=True, fields=None):
+    """Routes every logger (including discord.py's) through one handler; safe to call again to reconfigure.
+
+    `fields` (e.g. {'worker': 2}) is added to every record, and prefixed to each line in text format.
+    """
+    global _listener, _queue_handler
+    shutdown()
+    stream = logging.StreamHandler(sys.stdout)
+    prefix = "".join(f"{k}={v} " for k, v in (fields or {}).items())
+    stream.setFormatter(JsonFormatter() if fmt == "json" else TextFormatter(prefix))
+    if background:
+        _queue_handler = NonBlockingQueueHandler(queue.Queue(queue_size))
+        _listener = logging.handlers.QueueListener(_queue_handler.queue, stream, respect_handler_level=True)
+        _listener.start()
+        handler = _queue_handler
+    else:
+        handler = stream # Short-lived helper processes (yt-dlp workers) just write directly
+    handler.addFilter(RateLimitFilter(burst=rate_limit))
+    if fields: handler.addFilter(StaticFields(fields))
+    root = logging.getLogger()
+    for old in list(root.handlers): root.removeHandler(old)
+    root.addHandler(handler)
+    root.setLevel(level.upper())
+    ytdl_level = ytdl_level.upper()
+    logging.getLogger('ytdl').setLevel(logging.CRITICAL + 1 if ytdl_level == "OFF" else ytdl_level)
+
+def shutdown():
+    """Flushes queued records; call before exiting."""
+    global _listener
+    if _listener:
+        _listener.stop()
+        _listener = None
+
+def dropped():
+    return _queue_handler.dropped if _queue_handler else 0
@@ -0,0 +1,286 @@
+import asyncio
+import bisect
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+
+# --- Metrics ---
+# Histograms and counters are updated on hot paths (some from discord.py's audio threads), so an update is
+# a bisect and a couple of additions under a lock. Gauges are callbacks evaluated only when scraped.
+
+log = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _label_text(labels):
+    if not labels: return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in labels) + "}"
+
+class Counter:
+    def __init__(self, name, help):
+        self.name = name
+        self.help = help
+        self._values = {} # sorted label items -> value
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock: self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(tuple(sorted(labels.items())), 0)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock: items = list(self._values.items())
+        lines += [f"{self.name}{_label_text(labels)} {value}" for labels, value in items]
+        return lines
+
+class Histogram:
+    def __init__(self, name, help, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(buckets)
+        self._series = {} # sorted label items -> [bucket counts..., +Inf count, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None: series = self._series[key] = [0] * (len(self.buckets) + 2)
+            series[index] += 1
+            series[-1] += value
+
+    def summary(self, **labels):
+        """count, mean and approximate p50/p95/p99 (interpolated within buckets)."""
+        with self._lock: series = list(self._series.get(tuple(sorted(labels.items())), ()))
+        if not series: return {"count": 0}
+        counts, total = series[:-1], series[-1]
+        count = sum(counts)
+        if not count: return {"count": 0}
+        result = {"count": count, "mean": total / count}
+        for q in (0.5, 0.95, 0.99):
+            rank, seen = q * count, 0
+            for i, n in enumerate(counts):
+                if seen + n >= rank and n:
+                    lower = self.buckets[i - 1] if i else 0.0
+                    upper = self.buckets[i] if i < len(self.buckets) else lower * 2 or 1.0
+                    result[f"p{int(q * 100)}"] = lower + (upper - lower) * (rank - seen) / n
+                    break
+                seen += n
+        return result
+
+    def labelsets(self):
+        with self._lock: return [dict(key) for key in self._series]
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock: items = [(key, list(series)) for key, series in self._series.items()]
+        for labels, series in items:
+            cumulative = 0
+            for bound, n in zip(self.buckets + ('+Inf',), series[:-1]):
+                cumulative += n
+                lines.append(f"{self.name}_bucket{_label_text(labels + (('le', bound),))} {cumulative}")
+            lines.append(f"{self.name}_sum{_label_text(labels)} {series[-1]}")
+            lines.append(f"{self.name}_count{_label_text(labels)} {cumulative}")
+        return lines
+
+class Gauge:
+    def __init__(self, name, help, fn, label=None, kind="gauge"):
+        self.name = name
+        self.help = help
+        self.fn = fn # fn() -> number, or {label value: number} when `label` is set; None skips the sample
+        self.label = label
+        self.kind = kind # "counter" for totals kept elsewhere that are only read at scrape time
+
+    def value(self):
+        try: return self.fn()
+        except Exception as e:
+            log.debug("Gauge %s failed: %s", self.name, e)
+            return None
+
+    def render(self):
+        value = self.value()
+        if value is None: return []
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        if self.label: lines += [f"{self.name}{_label_text(((self.label, k),))} {v}" for k, v in value.items() if v is not None]
+        else: lines.append(f"{self.name} {value}")
+        return lines
+
+class Registry:
+    def __init__(self, prefix=""):
+        self.prefix = prefix
+        self.metrics = {}
+
+    def _add(self, metric):
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, help):
+        return self._add(Counter(self.prefix + name, help))
+
+    def histogram(self, name, help, buckets=LATENCY_BUCKETS):
+        return self._add(Histogram(self.prefix + name, help, buckets))
+
+    def gauge(self, name, help, fn, label=None):
+        return self._add(Gauge(self.prefix + name, help, fn, label))
+
+    def counter_fn(self, name, help, fn):
+        """A counter whose total is kept by someone else and read with fn() when scraped."""
+        return self._add(Gauge(self.prefix + name, help, fn, kind="counter"))
+
+    def render(self):
+        """Prometheus text exposition format."""
+        lines = []
+        for metric in list(self.metrics.values()): lines += metric.render()
+        return "\n".join(lines) + "\n"
+
+def count_child_processes(name):
+    # Linux only: scans /proc for our direct children with a matching command name; None elsewhere
+    if not os.path.isdir('/proc'): return None
+    pid, count = str(os.getpid()), 0
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit(): continue
+        try:
+            with open(f'/proc/{entry}/stat') as f: stat = f.read()
+        except OSError:
+            continue # Exited while we were looking
+        comm, _, rest = stat.partition('(')[2].rpartition(')')
+        if comm == name and rest.split()[1] == pid: count += 1
+    return count
+
+# --- Event Loop Monitoring ---
+
+class LoopMonitor:
+    """Records how late the event loop wakes a sleeping task, and dumps the loop thread's stack when it stalls.
+
+    The stall check runs on its own thread, so it can see code that blocks the loop while it is still blocking.
+    """
+
+    def __init__(self, histogram, interval=0.5, stall_threshold=1.0):
+        self.histogram = histogram
+        self.interval = interval
+        self.stall_threshold = stall_threshold
+        self.last_lag = 0.0
+        self.stalls = 0
+        self._heartbeat = time.monotonic()
+        self._task = None
+        self._loop_thread_id = None
+
+    def start(self):
+        if self._task and not self._task.done(): return
+        self._loop_thread_id = threading.get_ident()
+        self._heartbeat = time.monotonic()
+        self._task = asyncio.get_running_loop().create_task(self._run())
+        if self.stall_threshold: threading.Thread(target=self._watchdog, name="loop-watchdog", daemon=True).start()
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            self.last_lag = max(0.0, loop.time() - expected)
+            self.histogram.observe(self.last_lag)
+            self._heartbeat = time.monotonic()
+
+    def _watchdog(self):
+        reported = None
+        while self._task and not self._task.done():
+            time.sleep(min(0.1, self.stall_threshold / 4))
+            heartbeat = self._heartbeat
+            if time.monotonic() - heartbeat < self.interval + self.stall_threshold or heartbeat == reported: continue
+            reported = heartbeat # One dump per stall
+            self.stalls += 1
+            frame = sys._current_frames().get(self._loop_thread_id)
+            if frame is None: continue
+            stack = "".join(traceback.format_stack(frame))
+            log.warning("Event loop blocked for over %.1fs. Loop thread is at:\n%s", self.stall_threshold, stack)
+
+# --- Slow Command Sampling ---
+
+def _await_chain(coro):
+    # Task.get_stack() stops at the outermost coroutine; following cr_await reaches the innermost await
+    while coro is not None:
+        frame = getattr(coro, 'cr_frame', None) or getattr(coro, 'gi_frame', None)
+        if frame is None: return
+        yield frame, frame.f_lineno
+        coro = getattr(coro, 'cr_await', None) or getattr(coro, 'gi_yieldfrom', None)
+
+class SlowCommandSampler:
+    """Times every command and, for ones still running after `threshold` seconds, prints where they are awaiting.
+
+    Costs one timer handle per command; the stack is only captured for commands that actually run slow.
+    """
+
+    def __init__(self, histogram, counter, threshold=2.0):
+        self.histogram = histogram
+        self.counter = counter
+        self.threshold = threshold
+        self._running = {} # ctx -> (start time, TimerHandle)
+
+    def before(self, ctx):
+        task = asyncio.current_task()
+        handle = asyncio.get_running_loop().call_later(self.threshold, self._sample, ctx, task) if self.threshold and task else None
+        self._running[ctx] = (time.perf_counter(), handle)
+
+    def after(self, ctx):
+        started, handle = self._running.pop(ctx, (None, None))
+        if started is None: return
+        if handle: handle.cancel()
+        elapsed = time.perf_counter() - started
+        name = ctx.command.qualified_name if ctx.command else "unknown"
+        self.histogram.observe(elapsed, command=name)
+        if self.threshold and elapsed >= self.threshold:
+            self.counter.inc(command=name)
+            log.warning("!%s took %.2fs.", name, elapsed, extra={'guild': ctx.guild.id if ctx.guild else None})
+
+    def _sample(self, ctx, task):
+        if task.done(): return
+        stack = "".join(traceback.StackSummary.extract(_await_chain(task.get_coro())).format())
+        log.warning("!%s still running after %.1fs: %r. Awaiting at:\n%s", ctx.command, self.threshold, ctx.message.content, stack,
+                    extra={'guild': ctx.guild.id if ctx.guild else None})
+
+# --- Exporter ---
+
+class MetricsServer:
+    """Serves Registry.render() at /metrics for Prometheus. Uses aiohttp, which discord.py already depends on.
+
+    With `health` (a callable returning a dict with a 'ready' key) it also serves that dict as JSON at /health,
+    with status 503 until ready.
+    """
+
+    def __init__(self, registry, host='127.0.0.1', port=9108, health=None):
+        self.registry = registry
+        self.health = health
+        self.host = host
+        self.port = port
+        self._runner = None
+
+    async def start(self):
+        if self._runner: return
+        from aiohttp import web
+        async def handle(request):
+            return web.Response(body=self.registry.render().encode(), headers={'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'})
+        async def handle_health(request):
+            status = self.health()
+            return web.json_response(status, status=200 if status.get('ready') else 503)
+        app = web.Application()
+        app.router.add_get('/metrics', handle)
+        if self.health: app.router.add_get('/health', handle_health)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+        log.info("Metrics endpoint listening on http://%s:%d/metrics", self.host, self.port)
+
+    async def stop(self):
+        if self._runner:
+            await self._runner.cleanup()
+            self._runner = None
@@ -0,0 +1,79 @@
+import asyncio
+import logging
+import random
+import time
+
+log = logging.getLogger(__name__)
+
+# --- Reconnect Scheduler ---
+# Voice disconnects are reported by events (on_voice_state_update, a source stopping while disconnected);
+# each one gets its own retry task, so a slow connect in one guild never delays another. Guilds that are
+# connected have no task at all.
+
+class ReconnectScheduler:
+    def __init__(self, attempt, max_parallel=5, connects_per_second=2.0, base_delay=1.0, max_delay=120.0, max_attempts=12, give_up=None):
+        self.attempt = attempt # async attempt(guild_id) -> True when connected (or nothing left to reconnect)
+        self.give_up = give_up # async give_up(guild_id), called after max_attempts failures
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_attempts = max_attempts
+        self._min_interval = 1.0 / connects_per_second
+        self._slots = asyncio.Semaphore(max_parallel)
+        self._rate_lock = asyncio.Lock()
+        self._next_connect_at = 0.0
+        self._tasks = {} # guild_id -> asyncio.Task
+        self.successes = 0
+        self.failures = 0
+        self.given_up = 0
+
+    def request(self, guild_id, delay=None):
+        """Schedules reconnect attempts for `guild_id` unless some are already running."""
+        task = self._tasks.get(guild_id)
+        if task and not task.done(): return
+        self._tasks[guild_id] = asyncio.get_running_loop().create_task(
+            self._run(guild_id, self.base_delay if delay is None else delay))
+
+    def cancel(self, guild_id):
+        task = self._tasks.pop(guild_id, None)
+        if task and not task.done() and task is not asyncio.current_task(): task.cancel()
+
+    def pending(self, guild_id):
+        task = self._tasks.get(guild_id)
+        return bool(task) and not task.done()
+
+    async def _throttle(self):
+        # Spaces connects out globally so a mass disconnect (e.g. a Discord voice outage) doesn't stampede the gateway
+        async with self._rate_lock:
+            now = time.monotonic()
+            wait = self._next_connect_at - now
+            self._next_connect_at = max(now, self._next_connect_at) + self._min_interval
+        if wait > 0: await asyncio.sleep(wait)
+
+    async def _run(self, guild_id, delay):
+        try:
+            for attempt_no in range(1, self.max_attempts + 1):
+                # Full jitter keeps guilds that dropped together from retrying in lockstep
+                await asyncio.sleep(random.uniform(0.5, 1.5) * delay)
+                async with self._slots:
+                    await self._throttle()
+                    try: ok = await self.attempt(guild_id)
+                    except Exception:
+                        log.exception("Reconnect attempt %d raised", attempt_no, extra={'guild': guild_id})
+                        ok = False
+                if ok:
+                    self.successes += 1
+                    return
+                self.failures += 1
+                delay = min(self.max_delay, max(self.base_delay, delay) * 2)
+                log.info("Reconnect attempt %d failed; retrying in ~%.0fs.", attempt_no, delay, extra={'guild': guild_id})
+            self.given_up += 1
+            log.warning("Giving up reconnecting after %d attempts.", self.max_attempts, extra={'guild': guild_id})
+            if self.give_up: await self.give_up(guild_id)
+        finally:
+            if self._tasks.get(guild_id) is asyncio.current_task(): del self._tasks[guild_id]
+
+    def stats(self):
+        return {
+            "pending": sum(1 for t in self._tasks.values() if not t.done()),
+            "successes": self.successes, "failures": self.failures, "given_up": self.given_up,
+        }
@@ -0,0 +1,133 @@
+import asyncio
+import re
+import time
+from collections import OrderedDict
+from urllib.parse import urlparse, parse_qs
+
+# --- Resolution Cache ---
+# Maps a normalized query/URL to {"id", "title", "source"} so the same track
+# requested in several guilds only costs one yt-dlp extraction until its stream URL expires.
+
+YOUTUBE_ID_RE = re.compile(r'^[A-Za-z0-9_-]{11}$')
+YOUTUBE_HOSTS = ('youtube.com', 'www.youtube.com', 'm.youtube.com', 'music.youtube.com', 'youtu.be')
+
+def youtube_video_id(url: str):
+    try: parsed = urlparse(url)
+    except ValueError: return None
+    host = (parsed.hostname or "").lower()
+    if host not in YOUTUBE_HOSTS: return None
+    if host == 'youtu.be':
+        candidate = parsed.path.lstrip('/').split('/')[0]
+    elif parsed.path == '/watch':
+        candidate = parse_qs(parsed.query).get('v', [''])[0]
+    elif parsed.path.startswith(('/shorts/', '/embed/', '/live/')):
+        candidate = parsed.path.split('/')[2]
+    else:
+        return None
+    return candidate if YOUTUBE_ID_RE.match(candidate) else None
+
+def is_playlist_url(url: str):
+    """True for playlist links; a watch URL that merely carries a list= (mixes, "play all") still means one video."""
+    try: parsed = urlparse(url)
+    except ValueError: return False
+    if (parsed.hostname or "").lower() not in YOUTUBE_HOSTS or youtube_video_id(url): return False
+    return 'list' in parse_qs(parsed.query)
+
+def normalize_query(query: str):
+    query = query.strip()
+    if query.startswith("http://") or query.startswith("https://"):
+        video_id = youtube_video_id(query)
+        return f"yt:{video_id}" if video_id else f"url:{query}"
+    return "search:" + " ".join(query.lower().split())
+
+def stream_url_expiry(url: str):
+    """Returns the unix timestamp from the stream URL's `expire` parameter, or None."""
+    try: params = parse_qs(urlparse(url).query)
+    except ValueError: return None
+    if 'expire' not in params:
+        # Some googlevideo URLs carry their parameters as path segments: /expire/1700000000/...
+        match = re.search(r'/expire/(\d+)', url)
+        return int(match.group(1)) if match else None
+    try: return int(params['expire'][0])
+    except (ValueError, IndexError): return None
+
+class ResolutionCache:
+    def __init__(self, max_entries=512, default_ttl=1800, expiry_margin=120):
+        self.max_entries = max_entries
+        self.default_ttl = default_ttl # Used when the stream URL has no `expire` parameter
+        self.expiry_margin = expiry_margin # Drop entries this many seconds before YouTube would
+        self._entries = OrderedDict() # key -> (expires_at, song_info)
+        self._inflight = {} # key -> asyncio.Task running the shared fetch()
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _expires_at(self, song_info):
+        expire = stream_url_expiry(song_info["source"])
+        if expire is None: return time.time() + self.default_ttl
+        return expire - self.expiry_margin
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None: return None
+        expires_at, song_info = entry
+        if expires_at <= time.time():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return dict(song_info)
+
+    def put(self, key, song_info):
+        expires_at = self._expires_at(song_info)
+        if expires_at <= time.time(): return
+        keys = [key]
+        if song_info.get("id"): keys.append(f"yt:{song_info['id']}") # URL lookups for the same video hit too
+        for k in keys:
+            self._entries[k] = (expires_at, dict(song_info))
+            self._entries.move_to_end(k)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, key):
+        self._entries.pop(key, None)
+
+    async def resolve(self, query: str, fetch):
+        """Returns cached info for `query`, otherwise awaits `fetch()` once no matter how many callers ask at the same time.
+
+        The extraction runs as a task owned by the cache: a caller that is cancelled (e.g. a discarded prefetch)
+        stops waiting, but the lookup carries on for everyone else who joined it.
+        """
+        key = normalize_query(query)
+        song_info = self.get(key)
+        if song_info is not None:
+            self.hits += 1
+            return song_info
+        task = self._inflight.get(key)
+        if task is not None: self.coalesced += 1
+        else:
+            self.misses += 1
+            task = self._inflight[key] = asyncio.get_running_loop().create_task(self._fetch(key, fetch))
+            task.add_done_callback(lambda t: t.cancelled() or t.exception()) # Retrieved even if every caller gave up
+        result = await asyncio.shield(task)
+        return dict(result) if result else None
+
+    async def _fetch(self, key, fetch):
+        try:
+            result = await fetch()
+            if result: self.put(key, result)
+            return result
+        finally:
+            del self._inflight[key]
+
+    def stats(self):
+        lookups = self.hits + self.misses + self.coalesced
+        return {
+            "entries": len(self._entries), "hits": self.hits, "misses": self.misses,
+            "coalesced": self.coalesced, "evictions": self.evictions,
+            "hit_rate": (self.hits + self.coalesced) / lookups if lookups else 0.0,
+        }
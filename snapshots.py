@@ -0,0 +1,138 @@
+import asyncio
+import json
+import logging
+import os
+import tempfile
+import time
+
+log = logging.getLogger(__name__)
+
+# --- Player Snapshots ---
+# Per-guild player state is kept in one JSON-lines file so a deploy or crash doesn't wipe everyone's queue.
+# Changes only mark a guild dirty; every `interval` seconds the dirty guilds are re-encoded (the rest reuse
+# their last line) and the file is replaced atomically, so a crash mid-write leaves the previous snapshot.
+# Playback positions move without any change being marked; they are saved every `position_interval` seconds
+# on a line of their own, so a playing guild doesn't get its whole queue re-encoded just for its position.
+
+FORMAT_VERSION = 1
+
+class SnapshotStore:
+    def __init__(self, path, capture, read_paths=None, interval=2.0, max_age=12 * 3600, positions=None, position_interval=15.0):
+        self.path = path
+        self.capture = capture # capture(guild_id) -> JSON-able dict, or None when there is nothing worth restoring
+        self.read_paths = read_paths or [path] # Cluster workers also read the other workers' files (see load)
+        self.interval = interval
+        self.max_age = max_age # Older records are not restored
+        self.positions = positions # positions() -> {guild_id: seconds} for the guilds whose track is moving
+        self.position_interval = position_interval
+        self._positions_line = None
+        self._positions_due = 0.0
+        self._lines = {} # guild_id -> encoded record
+        self._dirty = set()
+        self._written = False # The first flush always writes, dropping records for guilds we no longer have
+        self._task = None
+        self.writes = 0
+        self.last_write_ms = None
+
+    def mark(self, guild_id):
+        self._dirty.add(guild_id)
+
+    def load(self):
+        """Reads every snapshot file; returns {guild_id: record}, keeping the newest record per guild."""
+        records, positions = {}, {} # positions: guild_id -> (saved_at, seconds)
+        for path in self.read_paths:
+            try:
+                with open(path, encoding='utf-8') as f: lines = f.read().splitlines()
+            except FileNotFoundError:
+                continue
+            except OSError as e:
+                log.warning("Could not read snapshot %s: %s", path, e)
+                continue
+            try:
+                if not lines or json.loads(lines[0]).get('version') != FORMAT_VERSION:
+                    log.warning("Ignoring snapshot %s: unknown format.", path)
+                    continue
+                for line in lines[1:]:
+                    record = json.loads(line)
+                    if 'positions' in record:
+                        for guild_id, position in record['positions'].items():
+                            guild_id = int(guild_id) # JSON object keys are strings
+                            if guild_id not in positions or record['saved_at'] > positions[guild_id][0]: positions[guild_id] = (record['saved_at'], position)
+                        continue
+                    guild_id = record['guild']
+                    if guild_id not in records or record['saved_at'] > records[guild_id]['saved_at']: records[guild_id] = record
+            except (ValueError, KeyError, AttributeError) as e:
+                log.warning("Snapshot %s is damaged (%s); restoring what was read before the damage.", path, e)
+        for guild_id, (saved_at, position) in positions.items():
+            record = records.get(guild_id)
+            if record and record.get('current') and saved_at >= record['saved_at']: # Positions are taken after the records they go with
+                record['position'], record['saved_at'] = position, saved_at # Still playing that track then, so the record is that fresh
+        cutoff = time.time() - self.max_age
+        return {guild_id: record for guild_id, record in records.items() if record['saved_at'] >= cutoff}
+
+    def _encode_dirty(self):
+        dirty, self._dirty = self._dirty, set()
+        now = round(time.time(), 1)
+        for guild_id in dirty:
+            record = self.capture(guild_id)
+            if record is None: self._lines.pop(guild_id, None)
+            else: self._lines[guild_id] = json.dumps({"guild": guild_id, "saved_at": now, **record}, separators=(',', ':'))
+        return bool(dirty)
+
+    def _encode_positions(self, force=False):
+        if not self.positions or (not force and time.monotonic() < self._positions_due): return False
+        self._positions_due = time.monotonic() + self.position_interval
+        positions, previous = self.positions(), self._positions_line
+        self._positions_line = json.dumps({"positions": {str(g): p for g, p in positions.items()}, "saved_at": round(time.time(), 1)},
+                                          separators=(',', ':')) if positions else None
+        return self._positions_line is not None or previous is not None
+
+    def _write(self, data):
+        started = time.perf_counter()
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp = tempfile.mkstemp(prefix='.' + os.path.basename(self.path), suffix='.tmp', dir=directory)
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, self.path)
+        except BaseException:
+            try: os.unlink(tmp)
+            except OSError: pass
+            raise
+        self.writes += 1
+        self.last_write_ms = (time.perf_counter() - started) * 1000
+
+    def _render(self):
+        lines = [json.dumps({"version": FORMAT_VERSION})] + list(self._lines.values())
+        if self._positions_line: lines.append(self._positions_line)
+        return "\n".join(lines) + "\n"
+
+    def flush(self):
+        """Writes pending changes right away, blocking; for shutdown."""
+        if self._encode_dirty() | self._encode_positions(force=True) or not self._written:
+            self._write(self._render())
+            self._written = True
+
+    def start(self):
+        if self._task and not self._task.done(): return
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    def stop(self):
+        if self._task: self._task.cancel()
+        self._task = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(self.interval)
+            if not (self._encode_dirty() | self._encode_positions()) and self._written: continue
+            try: await loop.run_in_executor(None, self._write, self._render()) # fsync off the event loop
+            except OSError as e:
+                log.warning("Could not write snapshot %s: %s", self.path, e)
+                continue
+            self._written = True
+
+    def stats(self):
+        return {"guilds": len(self._lines), "dirty": len(self._dirty), "writes": self.writes, "last_write_ms": self.last_write_ms}
@@ -0,0 +1,49 @@
+import time
+
+import discord
+
+# --- Audio Source Wrappers ---
+
+FRAME_SECONDS = 0.02 # discord.py reads one 20 ms frame per AudioSource.read()
+OPUS_SILENCE_FRAME = b'\xf8\xff\xfe' # One 20 ms Opus frame of silence
+
+class PositionTrackingSource(discord.AudioSource):
+    """Counts frames handed to discord.py so the player knows how far into the track it is.
+
+    discord.py stops calling read() while paused, so paused time isn't counted. Neither is OPUS_SILENCE_FRAME
+    filler (a shared stream stalling), which is not part of the track.
+    """
+
+    def __init__(self, inner, start=0.0, on_start=None):
+        self.inner = inner
+        self.start = start
+        self.frames = 0
+        self.on_start = on_start # Called once, from the audio thread, when the first frame is handed over
+        self.stopped_at = None # time.monotonic() when discord.py stopped reading (end of track or stop())
+
+    @property
+    def position(self):
+        return self.start + self.frames * FRAME_SECONDS
+
+    def read(self):
+        data = self.inner.read()
+        if data and data is not OPUS_SILENCE_FRAME:
+            if not self.frames and self.on_start: self.on_start()
+            self.frames += 1
+        return data
+
+    def is_opus(self):
+        return self.inner.is_opus()
+
+    def cleanup(self):
+        if self.stopped_at is None: self.stopped_at = time.monotonic()
+        self.inner.cleanup()
+
+class SilenceSource(discord.AudioSource):
+    """Endless Opus silence for stay mode: no ffmpeg, no encoding, and the same bytes object every frame."""
+
+    def read(self):
+        return OPUS_SILENCE_FRAME
+
+    def is_opus(self):
+        return True
@@ -0,0 +1,11 @@
+import pytest
+
+from bot import parse_timestamp
+
+@pytest.mark.parametrize("text, seconds", [("90", 90.0), ("1:30", 90.0), ("1:01:30", 3690.0), (" 2.5 ", 2.5), ("0", 0.0)])
+def test_parse_timestamp(text, seconds):
+    assert parse_timestamp(text) == seconds
+
+@pytest.mark.parametrize("text", ["", "abc", "-5", "1:-5", "1:2:3:4", "nan", "inf", "-inf", "1:nan", "1e308:0:0"])
+def test_parse_timestamp_rejects(text):
+    assert parse_timestamp(text) is None
@@ -0,0 +1,38 @@
+from guild_player import GuildPlayer, Track
+
+def player_with(count):
+    player = GuildPlayer(1)
+    player.enqueue_many(Track(f"Song {i}", None, id=f"id{i}") for i in range(1, count + 1))
+    return player
+
+def titles(player):
+    return [track.title for track in player.queue]
+
+def test_move():
+    player = player_with(4)
+    moved = player.move(3, 0)
+    assert moved.title == "Song 4"
+    assert titles(player) == ["Song 4", "Song 1", "Song 2", "Song 3"]
+    player.move(0, 3)
+    assert titles(player) == ["Song 1", "Song 2", "Song 3", "Song 4"]
+
+def test_page():
+    player = player_with(25)
+    page, page_count, entries = player.page(2)
+    assert (page, page_count) == (2, 3)
+    assert [(pos, track.title) for pos, track in entries][:2] == [(11, "Song 11"), (12, "Song 12")]
+    assert len(entries) == 10
+    assert player.page(99)[0] == 3 # Clamped to the last page
+    assert len(player.page(3)[2]) == 5
+    assert player.page(0)[0] == 1
+
+def test_page_of_empty_queue():
+    assert GuildPlayer(1).page(1) == (1, 1, [])
+
+def test_track_snapshot_leaves_out_stream_url():
+    track = Track("Song", "https://example.invalid/audio?expire=1", id="dQw4w9WgXcQ", page_url="https://youtu.be/dQw4w9WgXcQ")
+    data = track.snapshot()
+    assert data == {"id": "dQw4w9WgXcQ", "title": "Song", "page_url": "https://youtu.be/dQw4w9WgXcQ"}
+    restored = Track.from_snapshot(data)
+    assert not restored.resolved
+    assert restored.lookup_url == "https://youtu.be/dQw4w9WgXcQ"
@@ -0,0 +1,64 @@
+import asyncio
+
+from reconnect import ReconnectScheduler
+
+def make_scheduler(results, **kwargs):
+    calls, given_up = [], []
+    async def attempt(guild_id):
+        calls.append(guild_id)
+        return results.pop(0)
+    async def give_up(guild_id):
+        given_up.append(guild_id)
+    scheduler = ReconnectScheduler(attempt, connects_per_second=1000, base_delay=0.001, max_delay=0.01, give_up=give_up, **kwargs)
+    return scheduler, calls, given_up
+
+async def wait_idle(scheduler, guild_id):
+    while scheduler.pending(guild_id): await asyncio.sleep(0.001)
+
+def test_retries_until_connected():
+    async def scenario():
+        scheduler, calls, given_up = make_scheduler([False, False, True])
+        scheduler.request(1, delay=0)
+        scheduler.request(1, delay=0) # Already running; no second task
+        await wait_idle(scheduler, 1)
+        assert calls == [1, 1, 1]
+        assert given_up == []
+        assert scheduler.stats() == {"pending": 0, "successes": 1, "failures": 2, "given_up": 0}
+    asyncio.run(scenario())
+
+def test_gives_up_after_max_attempts():
+    async def scenario():
+        scheduler, calls, given_up = make_scheduler([False] * 3, max_attempts=3)
+        scheduler.request(1, delay=0)
+        await wait_idle(scheduler, 1)
+        assert len(calls) == 3
+        assert given_up == [1]
+    asyncio.run(scenario())
+
+def test_cancel_stops_retrying():
+    async def scenario():
+        scheduler, calls, given_up = make_scheduler([False] * 12)
+        scheduler.request(1, delay=10)
+        await asyncio.sleep(0)
+        scheduler.cancel(1)
+        await asyncio.sleep(0)
+        assert not scheduler.pending(1)
+        assert calls == [] and given_up == []
+    asyncio.run(scenario())
+
+def test_caps_parallel_attempts():
+    async def scenario():
+        running, peak = 0, 0
+        async def attempt(guild_id):
+            nonlocal running, peak
+            running += 1
+            peak = max(peak, running)
+            await asyncio.sleep(0.01)
+            running -= 1
+            return True
+        scheduler = ReconnectScheduler(attempt, max_parallel=2, connects_per_second=1000)
+        for guild_id in range(6): scheduler.request(guild_id, delay=0)
+        for guild_id in range(6): await wait_idle(scheduler, guild_id)
+        assert peak == 2
+        assert scheduler.successes == 6
+    asyncio.run(scenario())
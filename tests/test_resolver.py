@@ -0,0 +1,50 @@
+import asyncio
+
+import pytest
+
+from resolver import ResolutionCache, is_playlist_url
+
+INFO = {"id": "dQw4w9WgXcQ", "title": "Song", "source": "https://example.invalid/audio"}
+
+def test_cancelled_caller_does_not_cancel_joined_lookup():
+    async def scenario():
+        cache, calls = ResolutionCache(), []
+        async def fetch():
+            calls.append(1)
+            await asyncio.sleep(0.05)
+            return INFO
+        first = asyncio.create_task(cache.resolve("some song", fetch)) # Starts the lookup, like a prefetch
+        await asyncio.sleep(0)
+        second = asyncio.create_task(cache.resolve("Some  Song", fetch)) # Joins it, like play_song_in_vc
+        await asyncio.sleep(0)
+        first.cancel()
+        with pytest.raises(asyncio.CancelledError): await first
+        assert (await second)["title"] == "Song"
+        assert len(calls) == 1 and cache.coalesced == 1
+        assert (await cache.resolve("some song", fetch))["title"] == "Song" # Cached despite the starter being cancelled
+        assert len(calls) == 1
+    asyncio.run(scenario())
+
+def test_failed_lookup_reaches_every_caller_and_is_not_cached():
+    async def scenario():
+        cache = ResolutionCache()
+        async def fetch():
+            await asyncio.sleep(0.01)
+            raise RuntimeError("boom")
+        results = await asyncio.gather(cache.resolve("x", fetch), cache.resolve("x", fetch), return_exceptions=True)
+        assert all(isinstance(r, RuntimeError) for r in results)
+        assert len(cache) == 0 and not cache._inflight
+    asyncio.run(scenario())
+
+@pytest.mark.parametrize("url, playlist", [
+    ("https://www.youtube.com/playlist?list=PL1234", True),
+    ("https://music.youtube.com/playlist?list=PL1234", True),
+    ("https://www.youtube.com/watch?v=dQw4w9WgXcQ&list=RDdQw4w9WgXcQ", False),
+    ("https://youtu.be/dQw4w9WgXcQ?list=PL1234", False),
+    ("https://www.youtube.com/shorts/dQw4w9WgXcQ?list=PL1234", False),
+    ("https://www.youtube.com/watch?list=PL1234", True),
+    ("https://example.com/playlist?list=PL1234", False),
+    ("never gonna give you up", False),
+])
+def test_is_playlist_url(url, playlist):
+    assert is_playlist_url(url) is playlist
@@ -0,0 +1,50 @@
+import json
+import time
+
+from guild_player import Track
+from snapshots import SnapshotStore
+
+def make_store(path, records, positions=None, **kwargs):
+    return SnapshotStore(str(path), records.get, positions=positions and (lambda: positions), **kwargs)
+
+def test_round_trip(tmp_path):
+    track = Track("Song", "https://example.invalid/audio", id="dQw4w9WgXcQ", duration=212)
+    records = {1: {"channel": 10, "current": track.snapshot(), "position": 5.0, "queue": [track.snapshot()]}, 2: {"channel": 20, "stay": True}}
+    store = make_store(tmp_path / "state.jsonl", records)
+    for guild_id in (1, 2, 3): store.mark(guild_id) # 3 has nothing worth restoring
+    store.flush()
+    loaded = make_store(tmp_path / "state.jsonl", {}).load()
+    assert set(loaded) == {1, 2}
+    assert loaded[2]["stay"] is True
+    restored = Track.from_snapshot(loaded[1]["current"])
+    assert (restored.id, restored.title, restored.duration, restored.source) == ("dQw4w9WgXcQ", "Song", 212, None)
+    assert restored.lookup_url == "https://www.youtube.com/watch?v=dQw4w9WgXcQ"
+
+def test_positions_override_older_records(tmp_path):
+    positions = {1: 5.0}
+    records = {1: {"channel": 10, "current": {"id": "dQw4w9WgXcQ"}, "position": 0.0}}
+    store = make_store(tmp_path / "state.jsonl", records, positions=positions, position_interval=0)
+    store.mark(1)
+    store.flush()
+    positions[1] = 42.0
+    store.flush() # Only the positions line changes
+    assert make_store(tmp_path / "state.jsonl", {}).load()[1]["position"] == 42.0
+
+def test_truncated_file_keeps_complete_records(tmp_path):
+    path = tmp_path / "state.jsonl"
+    store = make_store(path, {1: {"channel": 10}, 2: {"channel": 20}})
+    store.mark(1)
+    store.mark(2)
+    store.flush()
+    data = path.read_text()
+    path.write_text(data[:data.rindex('"channel"')]) # Cut off mid-way through the last record
+    loaded = make_store(path, {}).load()
+    assert len(loaded) == 1
+
+def test_old_records_and_unknown_formats_are_ignored(tmp_path):
+    old = tmp_path / "old.jsonl"
+    old.write_text(json.dumps({"version": 1}) + "\n" + json.dumps({"guild": 1, "saved_at": time.time() - 7200, "channel": 10}) + "\n")
+    future = tmp_path / "future.jsonl"
+    future.write_text(json.dumps({"version": 99}) + "\n" + json.dumps({"guild": 2, "saved_at": time.time(), "channel": 20}) + "\n")
+    store = SnapshotStore(str(old), lambda g: None, read_paths=[str(old), str(future), str(tmp_path / "missing.jsonl")], max_age=3600)
+    assert store.load() == {}
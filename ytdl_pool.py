@@ -0,0 +1,211 @@
+import asyncio
+import logging
+import multiprocessing
+import os
+
+# --- yt-dlp Worker Pool ---
+# A fixed set of long-lived processes, each holding one warm YoutubeDL instance (cookies parsed once).
+# Extraction runs outside this process, so a burst of lookups uses every core instead of
+# fighting over the bot's GIL and the default executor.
+
+log = logging.getLogger(__name__)
+
+# Only these keys are sent back from workers; full info dicts (formats, thumbnails, ...) are large to pickle.
+INFO_KEYS = ('_type', 'id', 'title', 'url', 'webpage_url', 'duration', 'acodec', 'abr', 'asr', 'ext', 'protocol')
+
+class ExtractorBusy(Exception):
+    """Raised when too many extractions are already waiting for a worker."""
+
+class ExtractorError(Exception):
+    """Raised when a worker fails, crashes or times out on a job."""
+
+def _slim_info(info):
+    if not info: return None
+    slim = {k: info[k] for k in INFO_KEYS if k in info}
+    if info.get('entries') is not None:
+        slim['entries'] = [_slim_info(e) for e in info['entries'] if e]
+    return slim
+
+def _worker_main(conn, options, initializer=None):
+    if initializer: initializer() # e.g. logging setup; a forkserver child doesn't inherit the parent's
+    import yt_dlp
+    with yt_dlp.YoutubeDL(options) as ydl:
+        while True:
+            try: job = conn.recv()
+            except (EOFError, KeyboardInterrupt): break
+            if job is None: break
+            job_id, target, overrides = job
+            saved = {k: ydl.params.get(k) for k in overrides}
+            ydl.params.update(overrides) # Per-job options (e.g. flat playlist extraction) without a second instance
+            try:
+                info = ydl.extract_info(target, download=False)
+                conn.send((job_id, True, _slim_info(ydl.sanitize_info(info))))
+            except Exception as e:
+                conn.send((job_id, False, f"{type(e).__name__}: {e}"))
+            finally:
+                ydl.params.update(saved)
+
+class _Worker:
+    __slots__ = ('process', 'conn', 'jobs', 'broken')
+
+    def __init__(self, mp_context, options, initializer=None):
+        self.conn, child_conn = mp_context.Pipe()
+        self.process = mp_context.Process(target=_worker_main, args=(child_conn, options, initializer), daemon=True)
+        self.process.start()
+        child_conn.close()
+        self.jobs = 0
+        self.broken = False
+
+    def stop(self, force=False):
+        try:
+            if force: self.process.kill()
+            else: self.conn.send(None)
+        except (OSError, ValueError): pass
+        self.conn.close()
+
+class YtdlPool:
+    def __init__(self, options, size=None, timeout=30.0, max_pending=64, max_jobs_per_worker=200, start_method='forkserver', initializer=None):
+        self.options = dict(options)
+        self.initializer = initializer # Picklable callable run first in each worker process
+        self.size = size or min(4, os.cpu_count() or 1)
+        self.timeout = timeout
+        self.max_pending = max_pending # Extractions allowed to wait for a worker before we push back
+        self.max_jobs_per_worker = max_jobs_per_worker # Recycle workers so yt-dlp memory growth stays bounded
+        if start_method not in multiprocessing.get_all_start_methods(): start_method = 'spawn'
+        self._mp = multiprocessing.get_context(start_method)
+        if start_method == 'forkserver': self._mp.set_forkserver_preload(['yt_dlp', __name__])
+        self._idle = None
+        self._workers = set()
+        self._start_lock = None
+        self._next_job_id = 0
+        self.pending = 0
+        self.completed = 0
+        self.failures = 0
+        self.timeouts = 0
+        self.restarts = 0
+
+    @property
+    def started(self):
+        return self._idle is not None
+
+    async def start(self):
+        if self._start_lock is None: self._start_lock = asyncio.Lock()
+        async with self._start_lock:
+            if self.started: return
+            idle = asyncio.Queue()
+            loop = asyncio.get_running_loop()
+            # Spawned side by side: each one imports yt-dlp, which is most of a cold start
+            results = await asyncio.gather(*(loop.run_in_executor(None, _Worker, self._mp, self.options, self.initializer)
+                                             for _ in range(self.size)), return_exceptions=True)
+            workers = [w for w in results if isinstance(w, _Worker)]
+            if len(workers) < len(results):
+                for worker in workers: worker.stop(force=True)
+                raise next(r for r in results if not isinstance(r, _Worker))
+            for worker in workers:
+                self._workers.add(worker)
+                idle.put_nowait(worker)
+            self._idle = idle
+            log.info("yt-dlp worker pool started with %d process(es).", self.size)
+
+    async def extract(self, target: str, timeout=None, **overrides):
+        """Extracts `target` on a worker; `overrides` are yt-dlp options for this job only, `timeout` replaces the pool's."""
+        if self.pending >= self.max_pending:
+            raise ExtractorBusy(f"{self.pending} extractions already queued")
+        self.pending += 1
+        try:
+            if not self.started: await self.start()
+            worker = await self._idle.get()
+        except BaseException:
+            self.pending -= 1
+            raise
+        # The job is a task of its own: a caller that gives up (e.g. a discarded prefetch) stops waiting, while the
+        # worker finishes the job and goes back to the idle queue warm instead of being killed mid-extraction
+        job = asyncio.get_running_loop().create_task(self._job(worker, target, overrides, timeout or self.timeout))
+        job.add_done_callback(lambda t: t.cancelled() or t.exception()) # Retrieved even if the caller gave up
+        return await asyncio.shield(job)
+
+    async def _job(self, worker, target, overrides, timeout):
+        try:
+            return await self._run(worker, target, overrides, timeout)
+        finally:
+            self._release(worker)
+            self.pending -= 1
+
+    async def _run(self, worker, target, overrides, timeout):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._next_job_id += 1
+        job_id = self._next_job_id
+
+        def on_readable():
+            if future.done(): return
+            try: reply = worker.conn.recv()
+            except (EOFError, OSError) as e:
+                future.set_exception(ExtractorError(f"worker exited (code {worker.process.exitcode}): {e}"))
+                return
+            future.set_result(reply)
+
+        fd = worker.conn.fileno()
+        loop.add_reader(fd, on_readable)
+        try:
+            worker.conn.send((job_id, target, overrides))
+            reply_id, ok, payload = await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            worker.broken = True
+            self.timeouts += 1
+            raise ExtractorError(f"extraction timed out after {timeout}s: {target}")
+        except (ExtractorError, OSError) as e:
+            worker.broken = True
+            self.failures += 1
+            raise ExtractorError(str(e)) from e
+        except asyncio.CancelledError:
+            worker.broken = True # Only at shutdown (callers are shielded); a reply may still arrive, so don't reuse the worker
+            raise
+        finally:
+            loop.remove_reader(fd)
+        worker.jobs += 1
+        if reply_id != job_id:
+            worker.broken = True
+            raise ExtractorError(f"worker replied to job {reply_id}, expected {job_id}")
+        if not ok:
+            self.failures += 1
+            raise ExtractorError(payload)
+        self.completed += 1
+        return payload
+
+    def _release(self, worker):
+        if not worker.broken and worker.process.is_alive() and worker.jobs < self.max_jobs_per_worker:
+            self._idle.put_nowait(worker)
+            return
+        self._workers.discard(worker)
+        worker.stop(force=worker.broken or not worker.process.is_alive())
+        self.restarts += 1
+        asyncio.get_running_loop().create_task(self._replace_worker())
+
+    async def _replace_worker(self):
+        loop = asyncio.get_running_loop()
+        try:
+            worker = await loop.run_in_executor(None, _Worker, self._mp, self.options, self.initializer)
+        except Exception:
+            log.exception("Could not start a yt-dlp worker; retrying in 5s.")
+            await asyncio.sleep(5)
+            loop.create_task(self._replace_worker())
+            return
+        self._workers.add(worker)
+        self._idle.put_nowait(worker)
+
+    def close(self):
+        for worker in list(self._workers):
+            worker.stop()
+            worker.process.join(timeout=2)
+            if worker.process.is_alive(): worker.process.kill()
+        self._workers.clear()
+        self._idle = None
+
+    def stats(self):
+        return {
+            "size": self.size, "workers": len(self._workers),
+            "idle": self._idle.qsize() if self._idle else 0, "pending": self.pending,
+            "completed": self.completed, "failures": self.failures,
+            "timeouts": self.timeouts, "restarts": self.restarts,
+        }